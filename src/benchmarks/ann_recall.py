@@ -0,0 +1,62 @@
+"""Recall@k и задержка приближенного индекса LSHIndex относительно точного predict.
+
+Запуск из каталога src::
+
+    python -m benchmarks.ann_recall --users 1000000 --k 5 --top-n 10
+"""
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from processors.ann import LSHIndex
+from processors.matrix_factorization import RecommendationsProcessor
+
+
+def main() -> None:
+    """Запуск сравнения."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--tables', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--bits', type=int, nargs='+', default=[12, 16, 20])
+    parser.add_argument('--probes', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    # Факторы, полученные на неотрицательных интересах, в основном неотрицательны
+    P = np.abs(rng.standard_normal((args.users, args.k))).astype(np.float32)
+    P_normalized = RecommendationsProcessor.normalize(P)
+    rows = rng.choice(args.users, size=min(args.queries, args.users), replace=False)
+
+    started_at = time.perf_counter()
+    for row in rows:
+        RecommendationsProcessor.predict(P_normalized, int(row), top_n=args.top_n, normalized=True)
+    exact_latency = (time.perf_counter() - started_at) / len(rows) * 1000
+    exact_rows, _ = RecommendationsProcessor.predict_batch(P_normalized, rows, top_n=args.top_n, normalized=True)
+
+    print(f'users={args.users} k={args.k} top_n={args.top_n} queries={len(rows)}')
+    print(f'exact predict: {exact_latency:.3f} ms/query')
+    print(f'{"tables":>8}{"bits":>6}{"probes":>8}{"build, s":>10}{"ms/query":>10}{"recall@k":>10}')
+    for tables, bits, probes in itertools.product(args.tables, args.bits, args.probes):
+        started_at = time.perf_counter()
+        index = LSHIndex.build(P_normalized, tables=tables, bits=bits, probes=probes, seed=args.seed)
+        build_time = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        approximate_rows, _ = index.query(P_normalized[rows], top_n=args.top_n, exclude=rows)
+        latency = (time.perf_counter() - started_at) / len(rows) * 1000
+
+        recall = np.mean([
+            len(np.intersect1d(approximate, exact)) / args.top_n
+            for approximate, exact in zip(approximate_rows, exact_rows)
+        ])
+        print(f'{tables:>8}{bits:>6}{probes:>8}{build_time:>10.3f}{latency:>10.3f}{recall:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
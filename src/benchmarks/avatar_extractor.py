@@ -0,0 +1,83 @@
+"""Сравнение потокового извлечения og:image с разбором всей страницы BeautifulSoup.
+
+Страница отдается через httpx.MockTransport частями по --chunk-size байт,
+поэтому учитываются и объем прочитанных данных, и накладные расходы клиента.
+По умолчанию используется синтетическая страница профиля Telegram, можно
+передать сохраненную страницу через --page.
+
+Запуск из каталога src::
+
+    python -m benchmarks.avatar_extractor --body-kb 40 --repeat 200
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from httpx import AsyncClient, MockTransport, Request, Response
+
+from utils.avatar import read_avatar_url
+
+
+def _make_page(body_kb: int) -> bytes:
+    """Синтетическая страница профиля: заголовок с мета-тегами и тело заданного размера."""
+    head = ''.join(
+        f'<meta name="meta-{i}" content="{"x" * 40}">\n<link rel="preload" href="/static/{i}.js">\n'
+        for i in range(30)
+    )
+    head += '<meta property="og:image" content="https://cdn.telegram.org/file/avatar.jpg">\n'
+    body = '<div class="tgme_page"><span>profile</span></div>\n' * (body_kb * 1024 // 48)
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8">\n{head}</head><body>{body}</body></html>'.encode()
+
+
+async def _measure(client: AsyncClient, read, repeat: int) -> tuple[float, int, str | None]:
+    """Среднее процессорное время (мс) и объем прочитанных данных на один запрос."""
+    avatar_url, bytes_read = None, 0
+    started_at = time.process_time()
+    for _ in range(repeat):
+        async with client.stream('GET', 'https://t.me/user') as response:
+            avatar_url = await read(response)
+            bytes_read = response.num_bytes_downloaded
+    return (time.process_time() - started_at) / repeat * 1000, bytes_read, avatar_url
+
+
+async def _read_beautifulsoup(response: Response) -> str | None:
+    """Прежний способ: загрузка всей страницы и построение дерева BeautifulSoup."""
+    await response.aread()
+    image_meta = BeautifulSoup(response.text, 'html.parser').find('meta', property='og:image')
+    return image_meta['content'] if image_meta else None
+
+
+async def run(page: bytes, chunk_size: int, repeat: int) -> None:
+    """Запуск сравнения."""
+    async def stream():
+        for start in range(0, len(page), chunk_size):
+            yield page[start:start + chunk_size]
+
+    def handler(request: Request) -> Response:
+        return Response(200, headers={'Content-Type': 'text/html; charset=utf-8'}, content=stream())
+
+    async with AsyncClient(transport=MockTransport(handler)) as client:
+        print(f'page={len(page)} bytes chunk_size={chunk_size} repeat={repeat}')
+        print(f'{"method":<16}{"cpu, ms":>10}{"bytes read":>12}  avatar_url')
+        for name, read in (('beautifulsoup', _read_beautifulsoup), ('streaming', read_avatar_url)):
+            cpu_time, bytes_read, avatar_url = await _measure(client, read, repeat)
+            print(f'{name:<16}{cpu_time:>10.3f}{bytes_read:>12}  {avatar_url}')
+
+
+def main() -> None:
+    """Разбор аргументов и запуск сравнения."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page', type=Path, default=None)
+    parser.add_argument('--body-kb', type=int, default=40)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    page = args.page.read_bytes() if args.page is not None else _make_page(args.body_kb)
+    asyncio.run(run(page, args.chunk_size, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Время сериализации ответов API: стандартный путь FastAPI, адаптеры pydantic и быстрый режим.
+
+Сравниваются способы построения тела ответа из моделей Tortoise:
+
+- fastapi: валидация через response_model, dump_python(mode='json') и json.dumps,
+  как при возврате модели из обработчика;
+- validated: валидация и сериализация в байты заранее построенным адаптером
+  (режим по умолчанию, FAST_SERIALIZATION=false);
+- fast: поля схемы берутся из модели без валидации (FAST_SERIALIZATION=true).
+
+Запуск из каталога src::
+
+    python -m benchmarks.response_serialization --page-size 10 --repeat 2000
+"""
+import argparse
+import json
+import timeit
+from typing import Any, Callable
+
+from pydantic import BaseModel, TypeAdapter
+
+from config import get_settings
+from models import User
+from schemas.users import GetUserSchema, RecommendationUserSchema
+from utils.serialization import dump_json, dump_json_list, get_list_adapter, settings as serialization_settings
+
+settings = get_settings()
+
+
+def _make_user(user_id: int) -> User:
+    """Пользователь в памяти с заполненными полями профиля."""
+    user = User(
+        id=user_id,
+        username=f'user{user_id}',
+        telegram_link=f'https://t.me/user{user_id}',
+        avatar_url=f'https://cdn.telegram.org/file/{user_id}.jpg',
+        name='Name',
+        surname='Surname',
+        interests={key: user_id % 5 + 1 for key in settings.INTERESTS_KEYS},
+    )
+    setattr(user, 'rating', f'{0.5 + user_id / 1000:,.3f}')
+    return user
+
+
+def _methods(schema: type[BaseModel], many: bool) -> dict[str, Callable[[Any], bytes]]:
+    """Способы сериализации ответа схемы."""
+    adapter = get_list_adapter(schema) if many else TypeAdapter(schema)
+    dump = dump_json_list if many else dump_json
+
+    def dump_fast(obj: Any) -> bytes:
+        serialization_settings.FAST_SERIALIZATION = True
+        try:
+            return dump(schema, obj)
+        finally:
+            serialization_settings.FAST_SERIALIZATION = False
+
+    return {
+        'fastapi': lambda obj: json.dumps(
+            adapter.dump_python(adapter.validate_python(obj, from_attributes=True), mode='json'),
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode(),
+        'validated': lambda obj: dump(schema, obj),
+        'fast': dump_fast,
+    }
+
+
+def main() -> None:
+    """Запуск сравнения."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, default=settings.PAGE_SIZE)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    endpoints = {
+        'GET /users/{username}': (GetUserSchema, False, _make_user(1)),
+        'GET /recommendations': (
+            RecommendationUserSchema,
+            True,
+            [_make_user(user_id) for user_id in range(1, args.page_size + 1)],
+        ),
+    }
+
+    print(f'page_size={args.page_size} repeat={args.repeat}')
+    print(f'{"endpoint":<26}{"method":<12}{"us/response":>12}{"speedup":>10}')
+    for endpoint, (schema, many, obj) in endpoints.items():
+        methods = _methods(schema, many)
+        bodies = {name: json.loads(method(obj)) for name, method in methods.items()}
+        assert all(body == bodies['fastapi'] for body in bodies.values()), f'{endpoint}: ответы различаются'
+
+        baseline = None
+        for name, method in methods.items():
+            latency = min(timeit.repeat(lambda: method(obj), number=args.repeat, repeat=5)) / args.repeat * 1e6
+            baseline = baseline or latency
+            print(f'{endpoint:<26}{name:<12}{latency:>12.2f}{baseline / latency:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Масштабирование обучения и предсказания RecommendationsProcessor.
+
+Для каждой комбинации количества пользователей, k, steps и метода
+обучается модель на синтетических интересах (пользователи x INTERESTS_KEYS)
+и измеряются:
+
+- обучение: время, пиковая память (tracemalloc), количество итераций и итоговая ошибка;
+- предсказание для каждого типа данных: задержка одного запроса predict_batch
+  по матрице P, приведенной к типу (как при хранении в storage_dtype), и пиковая память.
+
+Обучение всегда идет в float64, поэтому модель обучается один раз, а тип
+данных влияет только на матрицу, по которой считаются предсказания.
+Результаты выводятся в JSON, чтобы сравнивать их между коммитами.
+
+Запуск из каталога src::
+
+    python -m benchmarks.scaling --users 1000 10000 100000 1000000 --output scaling.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from config import get_settings
+from processors.matrix_factorization import RecommendationsProcessor
+
+settings = get_settings()
+
+
+def generate_interests(users: int, seed: int = 0, latent: int = 3, missing: float = 0.1) -> np.ndarray:
+    """Синтетические интересы пользователей.
+
+    Оценки 1..5 строятся по небольшому числу скрытых факторов, чтобы у
+    матрицы была структура, которую восстанавливает факторизация; доля
+    `missing` оценок не указана (0), как у незаполненных интересов.
+
+    :param users: Количество пользователей.
+    :param seed: Seed генератора.
+    :param latent: Количество скрытых факторов.
+    :param missing: Доля неуказанных оценок.
+    :return: Матрица интересов (пользователи x INTERESTS_KEYS), float64.
+    """
+    rng = np.random.default_rng(seed)
+    interests = len(settings.INTERESTS_KEYS)
+
+    affinities = rng.random((users, latent)) @ rng.random((latent, interests)) / latent
+    ratings = np.clip(np.rint(1 + 4 * affinities + rng.normal(0, 0.5, (users, interests))), 1, 5)
+    ratings[rng.random((users, interests)) < missing] = 0
+    return ratings
+
+
+def _git_commit() -> str | None:
+    """Текущий коммит репозитория, если он доступен."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(func, *args, **kwargs) -> tuple[object, float, int]:
+    """Выполнение функции с измерением времени (с) и пиковой памяти (байт)."""
+    tracemalloc.reset_peak()
+    memory_before, _ = tracemalloc.get_traced_memory()
+    started_at = time.perf_counter()
+    result = func(*args, **kwargs)
+    wall_time = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    return result, wall_time, peak - memory_before
+
+
+def run_train(data: np.ndarray, k: int, steps: int, solver: str, seed: int) -> tuple[np.ndarray, dict]:
+    """Измерение обучения для одной комбинации параметров.
+
+    :return: Матрица P, результаты измерения.
+    """
+    (P, _, n_iter, loss), train_time, train_memory = _measure(
+        RecommendationsProcessor.factorize,
+        data,
+        k=k,
+        steps=steps,
+        solver=solver,
+        seed=seed,
+    )
+    return P, {
+        'wall_time_s': train_time,
+        'peak_memory_bytes': train_memory,
+        'n_iter': n_iter,
+        'loss': loss,
+    }
+
+
+def run_predict(P: np.ndarray, dtype: str, queries: int, top_n: int, seed: int) -> dict:
+    """Измерение предсказания по матрице P, приведенной к типу данных."""
+    P_normalized = RecommendationsProcessor.normalize(P.astype(dtype))
+    rows = np.random.default_rng(seed).choice(len(P), size=min(queries, len(P)), replace=False)
+    latencies = []
+    tracemalloc.reset_peak()
+    memory_before, _ = tracemalloc.get_traced_memory()
+    for row in rows:
+        started_at = time.perf_counter()
+        RecommendationsProcessor.predict_batch(P_normalized, [int(row)], top_n=top_n, normalized=True)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    _, predict_peak = tracemalloc.get_traced_memory()
+
+    return {
+        'queries': len(rows),
+        'top_n': top_n,
+        'latency_ms_mean': float(np.mean(latencies)),
+        'latency_ms_p50': float(np.percentile(latencies, 50)),
+        'latency_ms_p95': float(np.percentile(latencies, 95)),
+        'peak_memory_bytes': predict_peak - memory_before,
+    }
+
+
+def main() -> None:
+    """Запуск измерений."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--k', type=int, nargs='+', default=[5])
+    parser.add_argument('--steps', type=int, nargs='+', default=[500])
+    parser.add_argument('--dtypes', nargs='+', default=['float64', 'float32', 'float16'])
+    parser.add_argument('--solvers', nargs='+', choices=['als', 'gd'], default=['als'])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-n', type=int, default=settings.PAGE_SIZE)
+    parser.add_argument('--missing', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help='Файл для результатов в JSON, "-" - stdout.')
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'created_at': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': [],
+    }
+
+    tracemalloc.start()
+    print(
+        f'{"users":>9}{"k":>4}{"steps":>7}{"solver":>8}'
+        f'{"train, s":>10}{"train MB":>10}{"n_iter":>8}{"loss":>14}{"dtype":>9}{"ms/query":>10}',
+        file=sys.stderr,
+    )
+    for users in args.users:
+        data = generate_interests(users, seed=args.seed, missing=args.missing)
+        for k, steps, solver in itertools.product(args.k, args.steps, args.solvers):
+            P, train = run_train(data, k, steps, solver, args.seed)
+            result = {
+                'users': users,
+                'k': k,
+                'steps': steps,
+                'solver': solver,
+                'train': train,
+                'predict': {
+                    dtype: run_predict(P, dtype, args.queries, args.top_n, args.seed)
+                    for dtype in args.dtypes
+                },
+            }
+            report['results'].append(result)
+
+            train_columns = (
+                f'{users:>9}{k:>4}{steps:>7}{solver:>8}'
+                f'{train["wall_time_s"]:>10.3f}{train["peak_memory_bytes"] / 2 ** 20:>10.1f}'
+                f'{train["n_iter"]:>8}{train["loss"] or 0:>14.2f}'
+            )
+            for dtype, predict in result['predict'].items():
+                print(f'{train_columns}{dtype:>9}{predict["latency_ms_mean"]:>10.3f}', file=sys.stderr)
+                # Обучение общее для всех типов данных и выводится один раз
+                train_columns = ' ' * len(train_columns)
+    tracemalloc.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Сравнение форматов хранения матрицы факторов пользователей.
+
+Запуск из каталога src::
+
+    python -m benchmarks.serialization --users 100000 --k 5
+"""
+import argparse
+import json
+import timeit
+
+import numpy as np
+
+from utils.recommendations import encode_matrix, decode_matrix
+
+
+def _measure(func, repeat: int) -> float:
+    """Минимальное время выполнения функции в миллисекундах."""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main() -> None:
+    """Запуск сравнения."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    P = np.random.default_rng(0).random((args.users, args.k))
+
+    formats = {
+        'json': (
+            lambda: json.dumps(P.tolist()),
+            lambda raw: np.array(json.loads(raw)),
+        ),
+        'float32': (
+            lambda: encode_matrix(P, 'float32'),
+            decode_matrix,
+        ),
+        'float16': (
+            lambda: encode_matrix(P, 'float16'),
+            decode_matrix,
+        ),
+    }
+
+    print(f'users={args.users} k={args.k}')
+    print(f'{"format":<10}{"bytes":>14}{"encode, ms":>14}{"decode, ms":>14}')
+    for name, (encode, decode) in formats.items():
+        raw = encode()
+        encode_time = _measure(encode, args.repeat)
+        decode_time = _measure(lambda: decode(raw), args.repeat)
+        print(f'{name:<10}{len(raw):>14}{encode_time:>14.3f}{decode_time:>14.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Стоимость получения пользователя из токена с кэшем проверенных токенов и без него.
+
+Запуск из каталога src::
+
+    python -m benchmarks.token_cache --tokens 1000 --requests 100000
+"""
+import argparse
+import random
+import time
+
+import jwt
+
+from config import get_auth_settings
+from utils.auth import Token, TokenCache
+
+auth_settings = get_auth_settings()
+
+
+def main() -> None:
+    """Запуск сравнения."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tokens = [Token.generate_token(f'user{i}') for i in range(args.tokens)]
+    # Каждый запрос приходит с токеном одного из пользователей
+    requests = random.Random(args.seed).choices(tokens, k=args.requests)
+    cache = TokenCache(maxsize=args.tokens)
+
+    methods = {
+        'jwt.decode': lambda token: jwt.decode(
+            token,
+            auth_settings.SECRET_KEY,
+            algorithms=[auth_settings.ALGORITHM],
+        ),
+        'TokenCache': cache.decode,
+    }
+
+    print(f'tokens={args.tokens} requests={args.requests}')
+    print(f'{"method":<12}{"us/request":>12}')
+    for name, decode in methods.items():
+        started_at = time.perf_counter()
+        for token in requests:
+            decode(token)['sub']
+        latency = (time.perf_counter() - started_at) / args.requests * 1e6
+        print(f'{name:<12}{latency:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,5 +3,6 @@ from config.config import (
     get_cache_settings,
     get_auth_settings,
     get_recommendations_settings,
+    get_avatar_settings,
     get_settings,
 )
@@ -1,5 +1,6 @@
 from functools import lru_cache
 from pathlib import Path
+from typing import Literal
 
 from pydantic import computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -58,18 +59,71 @@ class AuthSettings(BaseAppSettings):
     SECRET_KEY: str
     TOKEN_EXPIRY: int = 15
     ALGORITHM: str = 'HS256'
+    TOKEN_CACHE_SIZE: int = 10000
     AUTH_COOKIE_KEY: str = 'auth'
 
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_LOCAL_TTL: float = 5.0
+    USER_CACHE_TTL: int = 300
+
 
 class RecommendationsSettings(BaseAppSettings):
     """Конфигурация работы алгоритма рекомендаций."""
 
+    solver: Literal['als', 'gd'] = 'als'
+    tol: float = 1e-4
+    seed: int | None = None
+    warm_start: bool = True
     k: int = 5
     steps: int = 500
     alpha: float = 1e-4
     reg_param: float = 0.8
     verbose: bool = False
 
+    precompute_neighbors: bool = True
+    neighbors_count: int = 100
+    batch_size: int = 1024
+    neighbors_chunk_size: int = 65536
+    read_batch_size: int = 5000
+    storage_dtype: Literal['float32', 'float16'] = 'float32'
+    rendered_ttl: int = 600
+    exclusions_limit: int = 10000
+    exclusions_ttl: int = 30 * 24 * 3600
+
+    ann_enabled: bool = False
+    ann_tables: int = 4
+    ann_bits: int = 20
+    ann_probes: int = 2
+
+    retrain_cron: str = '0 3 * * *'
+    retrain_drift: float = 0.1
+    retrain_debounce: float = 5.0
+    retrain_timeout: int = 3600
+    version_grace_period: int = 300
+    heartbeat_interval: float = 10.0
+
+    executor: Literal['process', 'thread'] = 'process'
+    executor_workers: int = 1
+    blas_threads: int = 1
+
+
+class AvatarSettings(BaseAppSettings):
+    """Конфигурация получения аватаров пользователей."""
+
+    avatar_concurrency: int = 32
+    avatar_host_concurrency: int = 8
+    avatar_max_connections: int = 64
+    avatar_connect_timeout: float = 5.0
+    avatar_timeout: float = 10.0
+    avatar_max_bytes: int = 65536
+    avatar_drain_bytes: int = 16384
+    avatar_batch_size: int = 500
+    avatar_validators_ttl: int = 7 * 24 * 3600
+    avatar_result_ttl: int = 300
+    avatar_pending_ttl: int = 120
+    avatar_retries: int = 3
+    avatar_retry_delay: float = 1.0
+
 
 class Settings(BaseAppSettings):
     """Конфигурация приложения."""
@@ -94,6 +148,7 @@ class Settings(BaseAppSettings):
     CORS_ALLOW_HEADERS: list[str] = ['*']
 
     PAGE_SIZE: int = 10
+    FAST_SERIALIZATION: bool = False
 
 
 @lru_cache
@@ -132,6 +187,15 @@ def get_recommendations_settings() -> RecommendationsSettings:
 recommendations_settings: RecommendationsSettings = get_recommendations_settings()
 
 
+@lru_cache
+def get_avatar_settings() -> AvatarSettings:
+    """Получение настроек получения аватаров."""
+    return AvatarSettings()
+
+
+avatar_settings: AvatarSettings = get_avatar_settings()
+
+
 @lru_cache
 def get_settings() -> Settings:
     """Получение конфигурации приложения."""
@@ -3,11 +3,11 @@ from typing import Annotated, TypeAlias
 
 from fastapi import Request, Response, Depends, HTTPException
 
-import models
 from config import get_auth_settings
 from models import User
 from schemas.auth import UserAuthSchema
 from utils.auth import generate_password_hash, Token
+from utils.users import user_cache
 
 auth_settings: TypeAlias = get_auth_settings()
 
@@ -64,7 +64,7 @@ async def get_request_user(request: Request) -> User:
     except Exception:
         raise HTTPException(status_code=401, detail='Некорректные авторизационные данные.')
 
-    user = await models.User.get_or_none(username=username)
+    user = await user_cache.get(request.app.state.cache, username)
     if not user:
         raise HTTPException(status_code=401, detail='Некорректные авторизационные данные.')
 
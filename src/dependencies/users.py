@@ -6,7 +6,6 @@ from models import User
 from schemas.users import RegisterUserSchema
 
 from utils.auth import generate_password_hash
-from utils.avatar import get_avatar_url
 
 
 async def register_user_info(
@@ -15,7 +14,6 @@ async def register_user_info(
     """Данные для регистрации пользователя."""
     user = User(**user_info.model_dump(mode='python'))
     user.password = generate_password_hash(user.password)
-    user.avatar_url = await get_avatar_url(user.telegram_link)
     return user
 
 
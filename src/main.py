@@ -13,8 +13,9 @@ from routers import (
     users_api_router,
     recommendations_api_router,
 )
-from tasks.process_recommendations import process_users_info
+from tasks.process_recommendations import request_retrain
 from tasks.update_avatars import update_users_avatars
+from utils.recommendations import RecommendationsModelCache
 
 settings = get_settings()
 cache = get_cache_settings()
@@ -26,9 +27,10 @@ async def lifespan(_app: FastAPI):
     async with init_db(app):
         async with get_cache() as _cache:
             _app.state.cache = _cache
+            _app.state.recommendations_model = RecommendationsModelCache()
 
             async with init_broker():
-                await process_users_info.kiq()
+                await request_retrain()
                 await update_users_avatars.kiq()
                 yield
 
@@ -1,8 +1,12 @@
-from tortoise.signals import post_save
+import redis.asyncio as redis
+from tortoise.signals import post_delete, post_save
 
+from broker import taskiq_broker
 from config import get_settings
 from models import User
-from tasks.process_recommendations import process_users_info
+from tasks.process_recommendations import fold_in_user
+from tasks.update_avatars import request_avatar_update
+from utils.users import invalidate_users
 
 settings = get_settings()
 
@@ -15,6 +19,45 @@ async def process_recommendation(
     *args,
     **kwargs,
 ) -> None:
-    """Запуск процесса формирования рекомендаций."""
+    """Добавление нового пользователя в модель рекомендаций."""
     if created:
-        await process_users_info.kiq()
+        await fold_in_user.kiq(instance.id)
+
+
+@post_save(User)
+async def process_avatar(
+    sender: type[User],
+    instance: User,
+    created: bool,
+    *args,
+    **kwargs,
+) -> None:
+    """Получение аватара нового пользователя вне запроса регистрации."""
+    if created:
+        await request_avatar_update(instance.id)
+
+
+@post_save(User)
+async def invalidate_saved_user(
+    sender: type[User],
+    instance: User,
+    created: bool,
+    *args,
+    **kwargs,
+) -> None:
+    """Удаление сохраненного пользователя из кэша."""
+    if not created:
+        async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+            await invalidate_users(cache_client, [instance.id])
+
+
+@post_delete(User)
+async def invalidate_deleted_user(
+    sender: type[User],
+    instance: User,
+    *args,
+    **kwargs,
+) -> None:
+    """Удаление удаленного пользователя из кэша."""
+    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+        await invalidate_users(cache_client, [instance.id])
@@ -0,0 +1,174 @@
+# noqa
+
+import numpy as np
+from typing import Tuple
+
+from processors.matrix_factorization import RecommendationsProcessor
+
+
+class LSHIndex:
+    """Approximate nearest-neighbour index for cosine similarity.
+
+    Random-hyperplane LSH: every table hashes a vector to the signs of its
+    projections on `bits` random hyperplanes. Candidates of a query are the
+    vectors sharing a bucket with it in any table, and they are re-ranked
+    with exact cosine similarity.
+
+    Latent factors are mostly non-negative and occupy a narrow cone, so the
+    hyperplanes pass through the mean of the indexed vectors instead of the
+    origin; otherwise almost all vectors fall into a few buckets.
+    """
+
+    # Number of vectors hashed at once, bounds the (block x tables x bits) buffer
+    HASH_BLOCK_SIZE = 65536
+
+    def __init__(self, hyperplanes: np.ndarray, vectors: np.ndarray, probes: int = 1) -> None:
+        """
+        Builds hash tables of the vectors.
+
+        Args:
+            hyperplanes (np.ndarray): Random hyperplanes (tables x bits x k).
+            vectors (np.ndarray): Row-normalized vectors (users x k).
+            probes (int): Number of extra buckets probed per table. The
+                probed buckets differ from the query bucket in one of the
+                bits with the smallest projections.
+        """
+        self.hyperplanes = np.asarray(hyperplanes, dtype=np.float32)
+        self.vectors = vectors
+        self.center = vectors.mean(axis=0) if len(vectors) else np.zeros(vectors.shape[1])
+        self.probes = min(probes, self.hyperplanes.shape[1])
+        self.powers = np.left_shift(1, np.arange(self.hyperplanes.shape[1], dtype=np.int64))
+
+        codes = self.hash(vectors)
+        # Rows sorted by bucket code in every table: buckets are contiguous ranges
+        self.order = np.argsort(codes, axis=0, kind='stable')
+        self.sorted_codes = np.take_along_axis(codes, self.order, axis=0)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        tables: int = 8,
+        bits: int = 12,
+        probes: int = 1,
+        seed: int | None = None,
+    ) -> "LSHIndex":
+        """Builds an index with new random hyperplanes.
+
+        More bits make buckets smaller (faster, lower recall), more tables
+        and probes add candidates (slower, higher recall).
+
+        Args:
+            vectors (np.ndarray): Row-normalized vectors (users x k).
+            tables (int): Number of hash tables.
+            bits (int): Number of hyperplanes per table (at most 62).
+            probes (int): Number of extra buckets probed per table.
+            seed (int | None): Seed of the hyperplanes.
+
+        Returns:
+            LSHIndex: The index.
+        """
+        rng = np.random.default_rng(seed)
+        hyperplanes = rng.standard_normal((tables, bits, vectors.shape[1]))
+        return cls(hyperplanes, vectors, probes)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        """Projects vectors on the hyperplanes.
+
+        Args:
+            vectors (np.ndarray): Vectors (n x k).
+
+        Returns:
+            np.ndarray: Projections (n x tables x bits).
+        """
+        return np.einsum('nk,tbk->ntb', vectors - self.center, self.hyperplanes)
+
+    def hash(self, vectors: np.ndarray) -> np.ndarray:
+        """Computes bucket codes of vectors in every table.
+
+        Args:
+            vectors (np.ndarray): Vectors (n x k).
+
+        Returns:
+            np.ndarray: Bucket codes (n x tables).
+        """
+        codes = np.empty((vectors.shape[0], self.hyperplanes.shape[0]), dtype=np.int64)
+        for start in range(0, vectors.shape[0], self.HASH_BLOCK_SIZE):
+            block = vectors[start:start + self.HASH_BLOCK_SIZE]
+            codes[start:start + len(block)] = (self.project(block) > 0).astype(np.int64) @ self.powers
+        return codes
+
+    def candidates(self, vector: np.ndarray) -> np.ndarray:
+        """Collects rows sharing a probed bucket with the vector.
+
+        Args:
+            vector (np.ndarray): Query vector (k).
+
+        Returns:
+            np.ndarray: Unique candidate rows.
+        """
+        projections = self.project(vector[None])[0]
+        codes = (projections > 0).astype(np.int64) @ self.powers
+
+        # Query-directed probing: flip the bits the query is least sure about
+        flipped_bits = np.argsort(np.abs(projections), axis=1)[:, :self.probes]
+        probe_codes = np.concatenate([codes[:, None], codes[:, None] ^ self.powers[flipped_bits]], axis=1)
+
+        parts = []
+        for table, table_codes in enumerate(probe_codes):
+            starts = np.searchsorted(self.sorted_codes[:, table], table_codes, side='left')
+            stops = np.searchsorted(self.sorted_codes[:, table], table_codes, side='right')
+            parts.extend(self.order[start:stop, table] for start, stop in zip(starts, stops) if stop > start)
+
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(parts))
+
+    def query(
+        self,
+        queries: np.ndarray,
+        top_n: int = 3,
+        exclude: np.ndarray | None = None,
+        mask: np.ndarray | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds approximate top-N most similar rows for every query.
+
+        Queries with fewer candidates than top_n fall back to an exact scan,
+        so every query gets a full result.
+
+        Args:
+            queries (np.ndarray): Row-normalized query vectors (n x k).
+            top_n (int): Number of returned rows.
+            exclude (np.ndarray | None): Row excluded for every query
+                (the query user itself).
+            mask (np.ndarray | None): Boolean mask of rows excluded for all
+                queries. Masked candidates are dropped before re-ranking.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Rows and similarities (n x top_n).
+        """
+        num_rows = self.vectors.shape[0]
+        allowed_rows = np.arange(num_rows) if mask is None else np.flatnonzero(~mask)
+        top_n = min(top_n, len(allowed_rows) - (1 if exclude is not None else 0))
+
+        indices = np.empty((len(queries), top_n), dtype=np.intp)
+        scores = np.empty((len(queries), top_n), dtype=np.result_type(self.vectors, np.float32))
+        for position, query in enumerate(queries):
+            candidates = self.candidates(query)
+            if mask is not None:
+                candidates = candidates[~mask[candidates]]
+            if exclude is not None:
+                candidates = candidates[candidates != exclude[position]]
+
+            if len(candidates) < top_n:
+                candidates = allowed_rows
+                if exclude is not None:
+                    candidates = candidates[candidates != exclude[position]]
+
+            candidate_scores = self.vectors[candidates] @ query
+            selected = RecommendationsProcessor.top_k(candidate_scores[None], top_n)[0]
+            indices[position] = candidates[selected]
+            scores[position] = candidate_scores[selected]
+
+        return indices, scores
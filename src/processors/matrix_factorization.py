@@ -1,7 +1,41 @@
 # noqa
 
 import numpy as np
-from typing import Tuple, List
+from typing import TYPE_CHECKING, Iterator, NamedTuple, Tuple, List
+
+if TYPE_CHECKING:
+    from processors.ann import LSHIndex
+
+# Share of observed entries above which training uses dense products
+DENSE_THRESHOLD = 0.25
+
+
+class Ratings(NamedTuple):
+    """Observed entries of the user-item matrix in coordinate form."""
+
+    rows: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+    shape: Tuple[int, int]
+
+    @classmethod
+    def from_dense(cls, data: np.ndarray) -> "Ratings":
+        """Builds ratings from a dense matrix, where entries > 0 are observed.
+
+        Args:
+            data (np.ndarray): The user-item preference matrix.
+
+        Returns:
+            Ratings: Observed entries of the matrix.
+        """
+        rows, cols = np.nonzero(data > 0)
+        return cls(rows, cols, data[rows, cols].astype(np.float64), data.shape)
+
+    @property
+    def density(self) -> float:
+        """Share of observed entries in the matrix."""
+        size = self.shape[0] * self.shape[1]
+        return len(self.values) / size if size else 0.0
 
 
 class RecommendationsProcessor:
@@ -9,47 +43,185 @@ class RecommendationsProcessor:
 
     def __init__(
         self,
-        data: np.ndarray,
+        data: np.ndarray | Ratings,
         k: int = 5,
         steps: int = 500,
         alpha: float = 1e-4,
         reg_param: float = 0.8,
         verbose: bool = False,
+        solver: str = 'als',
+        tol: float = 1e-4,
+        seed: int | None = None,
+        initial_P: np.ndarray | None = None,
+        initial_Q: np.ndarray | None = None,
     ) -> None:
         """
         Constructor of the class. Takes the user preferences matrix R
         and parameters for matrix factorization.
 
         Args:
-            R (np.ndarray): The user-item preference matrix (users-questions).
+            R (np.ndarray | Ratings): The user-item preference matrix
+                (users-questions), dense or as observed coordinates.
             k (int): The number of latent factors for matrix factorization.
-            steps (int): The number of iterations for ALS.
-            alpha (float): The learning rate.
+            steps (int): The maximum number of iterations.
+            alpha (float): The learning rate (gradient descent only).
             reg_param (float): The regularization parameter.
+            solver (str): 'als' for alternating least squares,
+                'gd' for full-batch gradient descent.
+            tol (float): Relative loss change below which ALS stops early.
+            seed (int | None): Seed of the random initialization.
+            initial_P (np.ndarray | None): Starting user matrix (warm start).
+                Rows containing NaN are initialized randomly.
+            initial_Q (np.ndarray | None): Starting item matrix (warm start).
         """
+        if solver not in ('als', 'gd'):
+            raise ValueError(f"Unknown solver: {solver}")
+
         self.verbose = verbose
         self.data = data
+        # Training works only with observed entries, dense input is converted
+        self.ratings = data if isinstance(data, Ratings) else Ratings.from_dense(data)
+        # Mostly observed matrices are multiplied densely, because BLAS products
+        # beat per-entry sums there. Flat positions of the observed entries are
+        # used to scatter/gather them.
+        self._positions: np.ndarray | None = None
+        if self.ratings.density >= DENSE_THRESHOLD:
+            self._positions = np.ravel_multi_index((self.ratings.rows, self.ratings.cols), self.ratings.shape)
         self.k = k
         self.steps = steps
         self.alpha = alpha
         self.reg_param = reg_param
+        self.solver = solver
+        self.tol = tol
+        self.rng = np.random.default_rng(seed)
+        self.initial_P = initial_P
+        self.initial_Q = initial_Q
+
+        # Filled in by the solver: number of performed iterations and final loss
+        self.n_iter = 0
+        self.loss: float | None = None
 
         # Perform matrix factorization during initialization
         self.P, self.Q = self.matrix_factorization()
 
+    @classmethod
+    def factorize(
+        cls,
+        data: np.ndarray | Ratings,
+        **kwargs,
+    ) -> Tuple[np.ndarray, np.ndarray, int, float | None]:
+        """Trains the model and returns only its results.
+
+        Suited for running in a worker process: the input data is not sent
+        back with the result.
+
+        Args:
+            data (np.ndarray | Ratings): The user-item preference matrix.
+            **kwargs: Parameters of the processor.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, int, float | None]: Matrices P and Q,
+                number of performed iterations and the final loss.
+        """
+        processor = cls(data, **kwargs)
+        return processor.P, processor.Q, processor.n_iter, processor.loss
+
     def initialize_matrices(self) -> Tuple[np.ndarray, np.ndarray]:
-        """Initializes the matrices P and Q with random values.
+        """Initializes the matrices P and Q.
+
+        Values of the warm start matrices are used where they are given and
+        match the shape, the rest is filled with random values.
 
         Returns:
             Tuple[np.ndarray, np.ndarray]: The initialized matrices.
         """
-        num_users, num_questions = self.data.shape
+        num_users, num_questions = self.ratings.shape
         # User preference matrix
-        P = np.random.rand(num_users, self.k)
+        P = self.rng.random((num_users, self.k))
         # Item (question) feature matrix
-        Q = np.random.rand(num_questions, self.k)
+        Q = self.rng.random((num_questions, self.k))
+
+        if self.initial_P is not None and self.initial_P.shape == P.shape:
+            known = ~np.isnan(self.initial_P).any(axis=1)
+            P[known] = self.initial_P[known]
+        if self.initial_Q is not None and self.initial_Q.shape == Q.shape:
+            Q[:] = self.initial_Q
         return P, Q
 
+    @classmethod
+    def align_rows(
+        cls,
+        matrix: np.ndarray,
+        matrix_ids: np.ndarray,
+        ids: np.ndarray,
+    ) -> np.ndarray:
+        """Reorders rows of a matrix to the given ids.
+
+        Used to warm start from a previously trained matrix: rows of removed
+        users are dropped, rows of new users are filled with NaN.
+
+        Args:
+            matrix (np.ndarray): The previous matrix.
+            matrix_ids (np.ndarray): Ids of the previous matrix rows.
+            ids (np.ndarray): Ids of the required rows.
+
+        Returns:
+            np.ndarray: The matrix with rows ordered as ids.
+        """
+        aligned = np.full((len(ids), matrix.shape[1]), np.nan)
+        if len(matrix_ids) == 0:
+            return aligned
+
+        order = np.argsort(matrix_ids)
+        positions = np.searchsorted(matrix_ids, ids, sorter=order)
+        positions = np.minimum(positions, len(matrix_ids) - 1)
+        found = matrix_ids[order[positions]] == ids
+        aligned[found] = matrix[order[positions[found]]]
+        return aligned
+
+    def errors(self, P: np.ndarray, Q: np.ndarray) -> np.ndarray:
+        """Computes prediction errors of the observed entries.
+
+        Args:
+            P (np.ndarray): User preference matrix.
+            Q (np.ndarray): Item (question) feature matrix.
+
+        Returns:
+            np.ndarray: Errors of the observed entries.
+        """
+        rows, cols, values, _ = self.ratings
+        if self._positions is not None:
+            return values - np.take(P @ Q.T, self._positions)
+        return values - np.sum(np.take(P, rows, axis=0) * np.take(Q, cols, axis=0), axis=1)
+
+    def sparse_dot(self, weights: np.ndarray, factors: np.ndarray, transpose: bool = False) -> np.ndarray:
+        """Multiplies the sparse matrix W by dense factors.
+
+        W has `weights` at the observed entries and zeros elsewhere, so the
+        cost scales with the number of observed entries.
+
+        Args:
+            weights (np.ndarray): Values of W at the observed entries.
+            factors (np.ndarray): Dense factors (columns of W x d).
+            transpose (bool): Multiply W^T instead of W.
+
+        Returns:
+            np.ndarray: The product (rows of W x d).
+        """
+        if self._positions is not None:
+            matrix = np.zeros(self.ratings.shape)
+            np.put(matrix, self._positions, weights)
+            return (matrix.T if transpose else matrix) @ factors
+
+        rows, cols = (self.ratings.cols, self.ratings.rows) if transpose else (self.ratings.rows, self.ratings.cols)
+        size = self.ratings.shape[1] if transpose else self.ratings.shape[0]
+
+        gathered = np.take(factors, cols, axis=0) * weights[:, None]
+        result = np.empty((size, factors.shape[1]))
+        for column in range(factors.shape[1]):
+            result[:, column] = np.bincount(rows, weights=gathered[:, column], minlength=size)
+        return result
+
     def loss_function(self, P: np.ndarray, Q: np.ndarray) -> float:
         """Computes the loss (MSE) with regularization.
 
@@ -60,43 +232,140 @@ class RecommendationsProcessor:
         Returns:
             float: The computed loss value.
         """
-        data_hat = np.dot(P, Q.T)
-
-        error = (self.data - data_hat) * (self.data > 0)
-        mse = np.sum(np.square(error))
+        mse = np.sum(np.square(self.errors(P, Q)))
 
         reg_term = self.reg_param * (np.linalg.norm(P) + np.linalg.norm(Q))
         return mse + reg_term
 
     def matrix_factorization(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Performs matrix factorization with the configured solver.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The factorized matrices P and Q.
+        """
+        if self.solver == 'als':
+            return self.alternating_least_squares()
+        return self.gradient_descent()
+
+    def ridge_solve(self, factors: np.ndarray, transpose: bool = False) -> np.ndarray:
+        """Solves a ridge regression for every row against fixed factors.
+
+        For row u: x_u = (F_u^T F_u + reg * I)^-1 F_u^T r_u, where F_u are
+        the factors of the observed entries of the row. All rows are solved
+        in one batched call.
+
+        Args:
+            factors (np.ndarray): Fixed factors (Q for users, P for items).
+            transpose (bool): Solve items (columns) instead of users (rows).
+
+        Returns:
+            np.ndarray: Solved factors of the rows.
+        """
+        k = factors.shape[1]
+        ones = np.ones_like(self.ratings.values)
+        # Gram matrices of the observed factors for every row: (rows x k x k)
+        outer = (factors[:, :, None] * factors[:, None, :]).reshape(-1, k * k)
+        gram = self.sparse_dot(ones, outer, transpose).reshape(-1, k, k)
+        rhs = self.sparse_dot(self.ratings.values, factors, transpose)
+        return self.solve_normal_equations(gram, rhs, self.reg_param)
+
+    @classmethod
+    def solve_normal_equations(cls, gram: np.ndarray, rhs: np.ndarray, reg_param: float) -> np.ndarray:
+        """Solves (gram + reg * I) x = rhs for a batch of rows.
+
+        Args:
+            gram (np.ndarray): Gram matrices (rows x k x k).
+            rhs (np.ndarray): Right-hand sides (rows x k).
+            reg_param (float): The regularization parameter.
+
+        Returns:
+            np.ndarray: The solutions (rows x k).
+        """
+        # A small ridge keeps rows without observations solvable when reg_param is 0
+        gram = gram + np.eye(gram.shape[-1]) * max(reg_param, 1e-8)
+        return np.linalg.solve(gram, rhs[..., None])[..., 0]
+
+    @classmethod
+    def fold_in(cls, Q: np.ndarray, data: np.ndarray, reg_param: float = 0.8) -> np.ndarray:
+        """Solves latent vectors of new users against the frozen matrix Q.
+
+        This is the user half-step of ALS, so a new user can be added to a
+        trained model without refitting it.
+
+        Args:
+            Q (np.ndarray): Item (question) feature matrix.
+            data (np.ndarray): Preferences of the new users (users x questions),
+                entries > 0 are observed.
+            reg_param (float): The regularization parameter.
+
+        Returns:
+            np.ndarray: Latent vectors of the new users (users x k).
+        """
+        data = np.atleast_2d(data).astype(np.float64)
+        mask = (data > 0).astype(np.float64)
+        Q = np.asarray(Q, dtype=np.float64)
+
+        k = Q.shape[1]
+        outer = (Q[:, :, None] * Q[:, None, :]).reshape(-1, k * k)
+        gram = (mask @ outer).reshape(-1, k, k)
+        return cls.solve_normal_equations(gram, (data * mask) @ Q, reg_param)
+
+    def alternating_least_squares(self) -> Tuple[np.ndarray, np.ndarray]:
         """Performs matrix factorization using Alternating Least Squares (ALS).
 
+        Alternates closed-form ridge solves for P (with Q fixed) and Q (with
+        P fixed) over the observed entries, and stops when the relative loss
+        change drops below `tol` or after `steps` iterations.
+
         Returns:
             Tuple[np.ndarray, np.ndarray]: The factorized matrices P and Q.
         """
-        num_users, num_questions = self.data.shape
         P, Q = self.initialize_matrices()
-        Q = Q.T  # Transpose Q for ease of computation
 
-        # Создаем маску для известных значений
-        mask = self.data > 0  # mask[i, j] = True, если R[i, j] известно
+        previous_loss = self.loss_function(P, Q)
+        for step in range(self.steps):
+            P = self.ridge_solve(Q)
+            Q = self.ridge_solve(P, transpose=True)
+
+            loss = self.loss_function(P, Q)
+            self.n_iter, self.loss = step + 1, loss
+
+            if self.verbose:
+                print(f"Step {step}/{self.steps}, loss: {loss}")
+
+            if abs(previous_loss - loss) <= self.tol * max(abs(previous_loss), 1e-12):
+                break
+            previous_loss = loss
+
+        return P, Q
+
+    def gradient_descent(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Performs matrix factorization using full-batch gradient descent.
+
+        Runs exactly `steps` iterations with the learning rate `alpha`.
+        Errors and gradients are computed only over the observed entries.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The factorized matrices P and Q.
+        """
+        P, Q = self.initialize_matrices()
 
         for step in range(self.steps):
-            R_hat = np.dot(P, Q)
-            error_matrix = (self.data - R_hat) * mask
+            error = self.errors(P, Q)
 
-            P_grad = np.dot(error_matrix, Q.T) - self.reg_param * P
-            Q_grad = np.dot(error_matrix.T, P) - self.reg_param * Q.T
+            P_grad = self.sparse_dot(error, Q) - self.reg_param * P
+            Q_grad = self.sparse_dot(error, P, transpose=True) - self.reg_param * Q
 
             P += self.alpha * P_grad
-            Q += self.alpha * Q_grad.T
+            Q += self.alpha * Q_grad
 
             if self.verbose:
                 if step % 100 == 0:
-                    loss = self.loss_function(P, Q.T)
+                    loss = self.loss_function(P, Q)
                     print(f"Step {step}/{self.steps}, loss: {loss}")
 
-        return P, Q.T
+        self.n_iter, self.loss = self.steps, self.loss_function(P, Q)
+        return P, Q
 
     @classmethod
     def cosine_similarity(cls, vec1: np.ndarray, vec2: np.ndarray) -> float:
@@ -116,6 +385,88 @@ class RecommendationsProcessor:
             return 0.0
         return dot_product / (norm_vec1 * norm_vec2)
 
+    @classmethod
+    def normalize(cls, P: np.ndarray) -> np.ndarray:
+        """Scales every row of the matrix to unit length.
+
+        Rows with zero norm are kept as zero vectors, so their cosine
+        similarity with any other row is 0.0, as in `cosine_similarity`.
+
+        Args:
+            P (np.ndarray): User preference matrix.
+
+        Returns:
+            np.ndarray: The row-normalized matrix.
+        """
+        norms = np.linalg.norm(P, axis=1, keepdims=True)
+        return np.divide(P, norms, out=np.zeros_like(P, dtype=np.result_type(P, np.float32)), where=norms != 0)
+
+    @classmethod
+    def top_k(cls, scores: np.ndarray, top_n: int) -> np.ndarray:
+        """Selects indices of the top-N scores in every row.
+
+        Uses `argpartition`, so only the selected candidates are sorted.
+        The order matches a stable descending sort: equal scores are
+        ordered by index. Excluded positions must be set to -inf.
+
+        Args:
+            scores (np.ndarray): Scores matrix (queries x users).
+            top_n (int): Number of selected positions per row.
+
+        Returns:
+            np.ndarray: Indices of the selected positions (queries x top_n).
+        """
+        top_n = min(top_n, scores.shape[1])
+        if top_n <= 0:
+            return np.empty((scores.shape[0], 0), dtype=np.intp)
+
+        candidates = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+
+        # Rows where the boundary score is shared with non-selected
+        # positions are resolved with a full stable sort to keep the order
+        # deterministic.
+        threshold = candidate_scores.min(axis=1, keepdims=True)
+        ambiguous = np.flatnonzero((scores >= threshold).sum(axis=1) > top_n)
+        for row in ambiguous:
+            candidates[row] = np.argsort(-scores[row], kind='stable')[:top_n]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+
+        order = np.lexsort((candidates, -candidate_scores), axis=1)
+        return np.take_along_axis(candidates, order, axis=1)
+
+    @classmethod
+    def predict_batch(
+        cls,
+        P: np.ndarray,
+        user_ids: np.ndarray | List[int],
+        top_n: int = 3,
+        normalized: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Recommends top-N similar users for several users at once.
+
+        Args:
+            P (np.ndarray): User preference matrix.
+            user_ids (np.ndarray | List[int]): Rows of the users to generate
+                recommendations for.
+            top_n (int): Number of recommended users.
+            normalized (bool): Are rows of P already normalized?
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Rows of the recommended users and
+                their similarities (len(user_ids) x top_n).
+        """
+        P_normalized = P if normalized else cls.normalize(P)
+        user_ids = np.asarray(user_ids, dtype=np.intp)
+
+        scores = P_normalized[user_ids] @ P_normalized.T
+        # Users are never recommended to themselves
+        scores[np.arange(len(user_ids)), user_ids] = -np.inf
+
+        indices = cls.top_k(scores, min(top_n, P.shape[0] - 1))
+        return indices, np.take_along_axis(scores, indices, axis=1)
+
     @classmethod
     def predict(
         cls,
@@ -123,6 +474,7 @@ class RecommendationsProcessor:
         user_id: int,
         top_n: int = 3,
         verbose: bool = False,
+        normalized: bool = False,
     ) -> List[Tuple[int, float]]:
         """
         Recommends top-N users similar to the given user.
@@ -132,19 +484,13 @@ class RecommendationsProcessor:
             user_id (int): ID of the user to generate recommendations for.
             top_n (int): Number of recommended users.
             verbose (bool): Print log?
+            normalized (bool): Are rows of P already normalized?
         """
-        user_vector = P[user_id]
-        similarities: List[Tuple[int, float]] = []
-
-        for other_user_id in range(P.shape[0]):
-            if other_user_id != user_id:
-                similarity = cls.cosine_similarity(
-                    user_vector, P[other_user_id]
-                )
-                similarities.append((other_user_id, similarity))
-
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        top_similar_users = similarities[:top_n]
+        indices, scores = cls.predict_batch(P, [user_id], top_n=top_n, normalized=normalized)
+        top_similar_users = [
+            (int(other_user_id), float(similarity))
+            for other_user_id, similarity in zip(indices[0], scores[0])
+        ]
 
         if verbose:
             print(f"Top-{top_n} recommended users for User {user_id + 1}:")
@@ -155,3 +501,82 @@ class RecommendationsProcessor:
                 )
 
         return top_similar_users
+
+    @classmethod
+    def neighbors(
+        cls,
+        P: np.ndarray,
+        top_n: int = 3,
+        batch_size: int = 1024,
+        index: "LSHIndex | None" = None,
+        start: int = 0,
+        stop: int | None = None,
+        normalized: bool = False,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Computes top-N similar users for every user in blocks of rows.
+
+        Only a (batch_size x users) block of similarities is kept in memory
+        at a time.
+
+        Args:
+            P (np.ndarray): User preference matrix.
+            top_n (int): Number of neighbors per user.
+            batch_size (int): Number of users scored at once.
+            index (LSHIndex | None): Approximate index over the normalized
+                rows of P. Without it every user is scored against all users.
+            start (int): First row to compute neighbors for.
+            stop (int | None): Row to stop at (exclusive), defaults to all rows.
+            normalized (bool): Are rows of P already normalized?
+
+        Yields:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Rows of the block,
+                rows of their neighbors and similarities.
+        """
+        P_normalized = P if normalized else cls.normalize(P)
+        stop = P.shape[0] if stop is None else min(stop, P.shape[0])
+        for block_start in range(start, stop, batch_size):
+            rows = np.arange(block_start, min(block_start + batch_size, stop))
+            if index is not None:
+                indices, scores = index.query(P_normalized[rows], top_n=top_n, exclude=rows)
+            else:
+                indices, scores = cls.predict_batch(P_normalized, rows, top_n=top_n, normalized=True)
+            yield rows, indices, scores
+
+    @classmethod
+    def neighbors_chunk(
+        cls,
+        P: np.ndarray,
+        start: int,
+        stop: int,
+        top_n: int = 3,
+        batch_size: int = 1024,
+        index: "LSHIndex | None" = None,
+        normalized: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Computes top-N similar users for a range of rows in one call.
+
+        Unlike `neighbors`, returns plain arrays, so it can be submitted to
+        a process pool.
+
+        Args:
+            P (np.ndarray): User preference matrix.
+            start (int): First row of the range.
+            stop (int): Row to stop at (exclusive).
+            top_n (int): Number of neighbors per user.
+            batch_size (int): Number of users scored at once.
+            index (LSHIndex | None): Approximate index over the normalized
+                rows of P.
+            normalized (bool): Are rows of P already normalized?
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Rows of the range,
+                rows of their neighbors and similarities.
+        """
+        blocks = list(cls.neighbors(P, top_n, batch_size, index, start=start, stop=stop, normalized=normalized))
+        if not blocks:
+            return np.empty(0, dtype=np.intp), np.empty((0, 0), dtype=np.intp), np.empty((0, 0), dtype=np.float32)
+
+        rows, indices, scores = zip(*blocks)
+        return np.concatenate(rows), np.concatenate(indices), np.concatenate(scores)
@@ -1,60 +1,307 @@
-import json
 from collections import OrderedDict
 
 import numpy as np
 import redis.asyncio as redis
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, HTTPException, Request, Response
 
-from config import get_settings
+from config import get_settings, get_recommendations_settings
 from models import User
 from dependencies.auth import RequestUser
+from schemas.recommendations import RecommendationExclusionsSchema
 from schemas.users import RecommendationUserSchema
-from processors.matrix_factorization import RecommendationsProcessor
+from utils.recommendations import (
+    PageCursor,
+    RecommendationsModelCache,
+    decode_cursor,
+    decode_neighbors,
+    encode_cursor,
+    encode_neighbors,
+    add_exclusions,
+    get_exclusions,
+    get_neighbors_page,
+    get_ranked_offset,
+    get_rendered_recommendations,
+    get_rendered_stamp,
+    set_neighbors,
+    set_rendered_recommendations,
+)
+from utils.http import etag_matches
+from utils.serialization import dump_json_list
 
 settings = get_settings()
+recommendations_settings = get_recommendations_settings()
 
 recommendations_api_router = APIRouter(
     prefix='/recommendations',
 )
 
 
+async def _rank_neighbors(
+    cache_client: redis.Redis,
+    model_cache: RecommendationsModelCache,
+    user: User,
+) -> tuple[int, np.ndarray] | None:
+    """Расчет списка похожих пользователей по модели, закэшированной в памяти процесса.
+
+    Список рассчитывается один раз на версию модели и сохраняется в ней,
+    следующие страницы читаются из сохраненного списка.
+
+    :param cache_client: Клиент Redis.
+    :param model_cache: Кэш модели рекомендаций.
+    :param user: Пользователь.
+    :return: Версия модели, записи (user_id, score) или None, если пользователя нет в модели.
+    """
+    model = await model_cache.get(cache_client)
+    user_row = model.get_row(user.id) if model is not None else None
+    if user_row is None:
+        return None
+
+    neighbors = encode_neighbors(*model.predict(user_row, top_n=recommendations_settings.neighbors_count))
+    await set_neighbors(cache_client, model.version, user.id, neighbors)
+    return model.version, decode_neighbors(neighbors)
+
+
+async def _get_excluded_recommendations_page(
+    cache_client: redis.Redis,
+    model_cache: RecommendationsModelCache,
+    user: User,
+    exclusions: np.ndarray,
+    cursor: PageCursor | None,
+) -> tuple[np.ndarray, np.ndarray, str | None]:
+    """Расчет страницы рекомендаций без исключенных пользователей.
+
+    Исключенные пользователи маскируются при выборе лучших по модели,
+    закэшированной в памяти процесса, поэтому страница остается полной.
+    Список рассчитывается заново на каждый запрос, поэтому страница
+    продолжается после последнего пользователя предыдущей страницы, а не с
+    позиции: исключение уже показанных пользователей не сдвигает список.
+
+    :param cache_client: Клиент Redis.
+    :param model_cache: Кэш модели рекомендаций.
+    :param user: Пользователь.
+    :param exclusions: Идентификаторы исключенных пользователей.
+    :param cursor: Курсор страницы; None - первая страница.
+    :return: Идентификаторы рекомендуемых пользователей, оценки похожести, курсор следующей страницы.
+    """
+    model = await model_cache.get(cache_client)
+    user_row = model.get_row(user.id) if model is not None else None
+    if user_row is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), None
+
+    recommendation_users_ids, recommendation_scores = model.predict(
+        user_row,
+        top_n=recommendations_settings.neighbors_count,
+        exclusions=exclusions,
+    )
+
+    # Позиция курсора - количество уже показанных пользователей: всего показывается
+    # не больше `neighbors_count`, как и при чтении сохраненного списка
+    offset = cursor.offset if cursor is not None else 0
+    start = get_ranked_offset(recommendation_users_ids, recommendation_scores, cursor) if cursor is not None else 0
+    stop = start + min(settings.PAGE_SIZE, recommendations_settings.neighbors_count - offset)
+    page_users_ids, page_scores = recommendation_users_ids[start:stop], recommendation_scores[start:stop]
+
+    next_offset = offset + len(page_users_ids)
+    next_cursor = None
+    if next_offset < recommendations_settings.neighbors_count and stop < len(recommendation_users_ids):
+        next_cursor = encode_cursor(model.version, next_offset, page_users_ids[-1], page_scores[-1])
+    return page_users_ids, page_scores, next_cursor
+
+
+async def _get_recommendations_page(
+    request: Request,
+    user: User,
+    cursor: PageCursor | None,
+) -> tuple[np.ndarray, np.ndarray, str | None, bool]:
+    """Получение страницы рекомендаций из списка похожих пользователей.
+
+    Список хранится в версии модели, поэтому страница стоит одного чтения
+    диапазона списка. Если версии из курсора уже нет, страница читается из
+    опубликованной версии. Для пользователя с исключениями страница
+    рассчитывается по модели.
+
+    :param request: Запрос.
+    :param user: Пользователь.
+    :param cursor: Курсор страницы; None - первая страница опубликованной версии.
+    :return: Идентификаторы рекомендуемых пользователей, оценки похожести, курсор следующей страницы,
+        зависит ли страница от пользователей, добавленных в версию без переобучения: страница рассчитана
+        по модели в памяти процесса или списка пользователя еще нет в версии.
+    """
+    cache_client: redis.Redis = request.app.state.cache
+
+    exclusions = await get_exclusions(cache_client, user.id)
+    if exclusions is not None:
+        page = await _get_excluded_recommendations_page(
+            cache_client,
+            request.app.state.recommendations_model,
+            user,
+            exclusions,
+            cursor,
+        )
+        return *page, True
+
+    version, offset = (cursor.version, cursor.offset) if cursor is not None else (None, 0)
+    page = await get_neighbors_page(cache_client, user.id, offset, settings.PAGE_SIZE, version)
+    if page is not None and page[1] is None and version is not None:
+        page = await get_neighbors_page(cache_client, user.id, offset, settings.PAGE_SIZE)
+    if page is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), None, False
+
+    page_version, neighbors, neighbors_count = page
+    if neighbors is None and not recommendations_settings.precompute_neighbors:
+        ranked = await _rank_neighbors(cache_client, request.app.state.recommendations_model, user)
+        if ranked is not None:
+            page_version, neighbors = ranked
+            neighbors_count = len(neighbors)
+            neighbors = neighbors[offset:offset + settings.PAGE_SIZE]
+
+    if neighbors is None:
+        # Пользователь еще не добавлен в версию: после добавления список появится
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), None, True
+
+    next_offset = offset + settings.PAGE_SIZE
+    next_cursor = None
+    if next_offset < neighbors_count and len(neighbors):
+        next_cursor = encode_cursor(page_version, next_offset, neighbors['user_id'][-1], neighbors['score'][-1])
+    return neighbors['user_id'], neighbors['score'], next_cursor, False
+
+
+async def _render_recommendations(
+    request: Request,
+    user: User,
+    cursor: PageCursor | None = None,
+) -> tuple[bytes, list[int], str | None, bool]:
+    """Получение страницы рекомендаций и построение тела ответа.
+
+    :param request: Запрос.
+    :param user: Пользователь, отправивший запрос.
+    :param cursor: Курсор страницы; None - первая страница.
+    :return: Тело ответа, идентификаторы рекомендуемых пользователей, курсор следующей страницы,
+        зависит ли страница от пользователей, добавленных в версию без переобучения.
+    """
+    recommendation_users_ids, recommendation_scores, next_cursor, revised = await _get_recommendations_page(
+        request,
+        user,
+        cursor,
+    )
+
+    response_users_ids_map: dict[int, float | User] = OrderedDict()
+    response_users_ids_map.update({
+        int(recommendation_user_id): float(recommendation_score)
+        for recommendation_user_id, recommendation_score in zip(recommendation_users_ids, recommendation_scores)
+    })
+
+    async for user in User.filter(id__in=response_users_ids_map.keys()):
+        user: User
+        setattr(user, 'rating', f'{float(response_users_ids_map[user.id]):,.3f}')
+        response_users_ids_map[user.id] = user
+
+    users = [user for user in response_users_ids_map.values() if isinstance(user, User)]
+    body = dump_json_list(RecommendationUserSchema, users)
+    return body, [user.id for user in users], next_cursor, revised
+
+
+def _recommendations_response(body: bytes, next_cursor: str | None, etag: str | None = None) -> Response:
+    """Построение ответа со страницей рекомендаций.
+
+    :param body: Тело ответа.
+    :param next_cursor: Курсор следующей страницы, передается в заголовке X-Next-Cursor.
+    :param etag: ETag ответа.
+    :return: Ответ.
+    """
+    headers = {}
+    if next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+    if etag is not None:
+        headers['ETag'] = etag
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
 @recommendations_api_router.get(
     '',
     response_model=list[RecommendationUserSchema],
+    responses={
+        304: {'description': 'Рекомендации не изменились'},
+        400: {'description': 'Некорректный курсор'},
+    },
 )
 async def get_recommendations(
     request: Request,
     user: RequestUser,
-):
+    cursor: str | None = None,
+) -> Response:
     """Получение рекомендаций для пользователя.
 
+    Рекомендации отдаются страницами по `PAGE_SIZE` пользователей, курсор
+    следующей страницы передается в заголовке X-Next-Cursor. Страницы
+    читаются из списка, построенного по версии модели из курсора, поэтому
+    не смещаются при публикации новой версии.
+
+    Готовый ответ с первой страницей кэшируется до смены версии модели или
+    изменения профиля одного из рекомендуемых пользователей. Если ETag из
+    If-None-Match совпадает с ETag готового ответа, возвращается 304 без
+    обращения к БД и расчета рекомендаций.
+
     :param request: Запрос.
     :param user: Пользователь, отправивший запрос.
+    :param cursor: Курсор страницы. По умолчанию - первая страница.
+    :raises HTTPException: Некорректный курсор.
     """
     cache_client: redis.Redis = request.app.state.cache
 
-    recommendations_source: list[list[float]] = json.loads(await cache_client.get('recommendations'))
-    user_id_map: dict[str, int] = json.loads(await cache_client.get('user_map'))
+    if cursor is not None:
+        try:
+            page_cursor = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Некорректный курсор.')
+
+        body, _, next_cursor, _ = await _render_recommendations(request, user, page_cursor)
+        return _recommendations_response(body, next_cursor)
 
-    recommendation_user_id = int(next(i for i in user_id_map if user_id_map[i] == user.id))
+    rendered = await get_rendered_recommendations(cache_client, user.id)
+    if rendered is not None and rendered[2] is not None:
+        *_, etag, body, next_cursor = rendered
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status_code=304, headers={'ETag': etag})
+        return _recommendations_response(body, next_cursor, etag)
 
-    recommendations_array = np.array(recommendations_source)
-    recommendation_users_info: list[tuple[int, float]] = RecommendationsProcessor.predict(
-        recommendations_array,
-        user_id=recommendation_user_id,
-        top_n=settings.PAGE_SIZE,
+    body, recommended_user_ids, next_cursor, revised = await _render_recommendations(request, user)
+    if rendered is None:
+        # Модель еще не опубликована, кэшировать нечего
+        return _recommendations_response(body, next_cursor)
+
+    etag = await set_rendered_recommendations(
+        cache_client,
+        user.id,
+        get_rendered_stamp(rendered[0], rendered[1] if revised else None),
+        body,
+        next_cursor,
+        recommended_user_ids,
     )
+    return _recommendations_response(body, next_cursor, etag)
 
-    response_users_ids_map: dict[str, float | User] = OrderedDict()
-    response_users_ids_map.update({
-        user_id_map[str(recommendation_user_info[0])]: recommendation_user_info[1]
-        for recommendation_user_info in recommendation_users_info
-        if str(recommendation_user_info[0]) in user_id_map
-    })
 
-    async for user in User.filter(id__in=response_users_ids_map.keys()):
-        user: User
-        setattr(user, 'rating', f'{float(response_users_ids_map[user.id]):,.3f}')
-        response_users_ids_map[user.id] = user
+@recommendations_api_router.post(
+    '/exclusions',
+    response_model=None,
+    status_code=204,
+    responses={400: {'description': 'Пользователи не найдены'}},
+)
+async def exclude_recommendations(
+    request: Request,
+    user: RequestUser,
+    exclusions: RecommendationExclusionsSchema,
+) -> None:
+    """Исключение пользователей из рекомендаций (просмотренные или скрытые пользователи).
+
+    :param request: Запрос.
+    :param user: Пользователь, отправивший запрос.
+    :param exclusions: Исключаемые пользователи.
+    :raises HTTPException: Некоторые пользователи не найдены.
+    :return: 204
+    """
+    excluded_user_ids = set(exclusions.user_ids)
+    if await User.filter(id__in=excluded_user_ids).count() != len(excluded_user_ids):
+        raise HTTPException(status_code=400, detail='Пользователи не найдены.')
 
-    return [user for user in response_users_ids_map.values() if user is not None]
+    await add_exclusions(request.app.state.cache, user.id, exclusions.user_ids)
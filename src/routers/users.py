@@ -1,9 +1,13 @@
-from fastapi import APIRouter, HTTPException
+import redis.asyncio as redis
+from fastapi import APIRouter, HTTPException, Request, Response
 from tortoise.exceptions import IntegrityError, ValidationError
 
 from models import User
 from dependencies.users import RegisterUser
 from schemas.users import GetUserSchema
+from utils.http import etag_matches
+from utils.serialization import dump_json
+from utils.users import get_profile, set_profile
 
 users_api_router = APIRouter(
     prefix='/users',
@@ -30,16 +34,33 @@ async def register(register_user: RegisterUser) -> None:
 @users_api_router.get(
     '/{username}',
     response_model=GetUserSchema,
+    responses={304: {'description': 'Профиль не изменился'}},
 )
-async def get_user(username: str) -> User:
+async def get_user(request: Request, username: str) -> Response:
     """Получение информации о пользователе
 
+    Готовый ответ кэшируется в Redis до изменения пользователя. ETag ответа
+    строится по времени последнего изменения пользователя; если он совпадает
+    с If-None-Match, возвращается 304.
+
+    :param request: Запрос.
     :param username:
     :return: 200, GetUserSchema
     """
-    user = await User.get_or_none(username=username)
+    cache_client: redis.Redis = request.app.state.cache
+
+    profile = await get_profile(cache_client, username)
+    if profile is not None:
+        etag, body = profile
+    else:
+        user = await User.get_or_none(username=username)
+
+        if not user:
+            raise HTTPException(status_code=404)
 
-    if not user:
-        raise HTTPException(status_code=404)
+        body = dump_json(GetUserSchema, user)
+        etag = await set_profile(cache_client, user, body)
 
-    return user
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    return Response(content=body, media_type='application/json', headers={'ETag': etag})
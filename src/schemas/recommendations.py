@@ -0,0 +1,12 @@
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+# Идентификатор пользователя в диапазоне поля id в БД
+UserId = Annotated[int, Field(gt=0, le=2 ** 31 - 1)]
+
+
+class RecommendationExclusionsSchema(BaseModel):
+    """Схема для исключения пользователей из рекомендаций."""
+
+    user_ids: list[UserId] = Field(min_length=1, max_length=1000)
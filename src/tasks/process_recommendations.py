@@ -1,58 +1,463 @@
-import json
+import asyncio
+import functools
+import logging
+import time
+from typing import Any, Callable
 
 import redis.asyncio as redis
 import numpy as np
+from redis.asyncio.lock import Lock
+from redis.exceptions import WatchError
 
 from config import get_recommendations_settings, get_settings
 from broker import taskiq_broker
 from models import User
+from processors.ann import LSHIndex
 from processors.matrix_factorization import RecommendationsProcessor
+from utils.recommendations import (
+    RecommendationsModelCache,
+    MODEL_KEY,
+    MODEL_VERSION_KEY,
+    MODEL_SEQUENCE_KEY,
+    RETRAIN_PENDING_KEY,
+    RETRAIN_LOCK_KEY,
+    RETRAIN_METRICS_KEY,
+    RETRAIN_HEARTBEAT_KEY,
+    encode_folded,
+    encode_neighbors,
+    encode_matrix,
+    decode_matrix,
+    get_folded,
+    get_folded_dtype,
+    get_model_keys,
+    get_model_snapshot,
+    get_user_row,
+)
+from utils.executor import get_training_executor
+from utils.users import get_user_cache_metrics
+
+logger = logging.getLogger(__name__)
 
 settings = get_settings()
 recommendation_settings = get_recommendations_settings()
 
+# Опубликованная модель в памяти воркера: добавление пользователя дочитывает только новые записи
+model_cache = RecommendationsModelCache()
+
+
+async def request_retrain() -> bool:
+    """Запрос полного переобучения модели рекомендаций.
+
+    Запросы объединяются: пока переобучение ожидает запуска, новые запросы
+    только учитываются в метриках. Одновременно выполняется не более одного
+    переобучения и ожидает не более одного.
+
+    :return: Поставлена ли задача переобучения в очередь.
+    """
+    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+        async with cache_client.pipeline(transaction=True) as pipe:
+            pipe.hincrby(RETRAIN_METRICS_KEY, 'triggers', 1)
+            # Флаг ограничен по времени, чтобы упавшая задача не заблокировала переобучение навсегда
+            pipe.set(RETRAIN_PENDING_KEY, 1, nx=True, ex=recommendation_settings.retrain_timeout)
+            _, scheduled = await pipe.execute()
+
+        if not scheduled:
+            await cache_client.hincrby(RETRAIN_METRICS_KEY, 'coalesced', 1)
+            return False
+
+    await process_users_info.kiq()
+    return True
+
+
+async def get_retrain_metrics(cache_client: redis.Redis) -> dict[str, int]:
+    """Получение метрик запросов на переобучение.
+
+    :param cache_client: Клиент Redis.
+    :return: Количество запросов (triggers), объединенных запросов (coalesced) и переобучений (runs).
+    """
+    metrics = await cache_client.hgetall(RETRAIN_METRICS_KEY)
+    return {
+        name: int(metrics.get(name.encode(), 0))
+        for name in ('triggers', 'coalesced', 'runs')
+    }
+
+
+async def load_users_interests(max_user_id: int) -> tuple[np.ndarray, np.ndarray]:
+    """Чтение интересов пользователей из БД пачками по возрастанию id.
+
+    Интересы записываются в заранее выделенный массив, поэтому в памяти не
+    держатся промежуточные словари и списки для всех пользователей.
+
+    :param max_user_id: Максимальный идентификатор пользователя, попадающего в выборку.
+    :return: Идентификаторы пользователей, матрица интересов (пользователи x интересы).
+    """
+    users_count = await User.filter(id__lte=max_user_id).count()
+    user_ids = np.empty(users_count, dtype=np.int64)
+    users_interests = np.zeros((users_count, len(settings.INTERESTS_KEYS)), dtype=np.float32)
+
+    position, last_user_id = 0, 0
+    while position < users_count:
+        users_chunk = await (
+            User.filter(id__gt=last_user_id, id__lte=max_user_id)
+            .order_by('id')
+            .limit(recommendation_settings.read_batch_size)
+            .values_list('id', 'interests')
+        )
+        if not users_chunk:
+            break
+
+        # Пользователи, удаленные после подсчета, просто не попадают в массив
+        for user_id, user_interests in users_chunk[:users_count - position]:
+            user_ids[position] = user_id
+            users_interests[position] = get_interests_vector(user_interests)
+            position += 1
+        last_user_id = users_chunk[-1][0]
+
+    return user_ids[:position], users_interests[:position]
+
+
+def get_interests_vector(user_interests: dict[str, int]) -> list[int]:
+    """Получение вектора интересов пользователя.
+
+    :param user_interests: Интересы пользователя.
+    :return: Значения интересов в порядке `INTERESTS_KEYS`, отсутствующие - 0.
+    """
+    return [
+        user_interests.get(interest_key) or 0
+        for interest_key in settings.INTERESTS_KEYS
+    ]
+
 
 @taskiq_broker.task
-async def process_recommendations(users_interests_map: dict[int, list[int]]) -> None:
+async def process_recommendations(job: dict[str, int]) -> None:
     """Расчет рекомендаций для пользователей.
 
-    :param users_interests_map: Маппинг интересов пользователей.
+    :param job: Описание задачи: `max_user_id` - максимальный идентификатор
+        пользователя, попадающего в обучение.
     """
-    user_id_position_map = {
-        i: user_id
-        for i, user_id in enumerate(users_interests_map)
-    }
+    max_user_id = job['max_user_id']
+
+    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+        async with cache_client.lock(RETRAIN_LOCK_KEY, timeout=recommendation_settings.retrain_timeout) as lock:
+            # Запросы, пришедшие после начала обучения, должны поставить новое переобучение
+            await cache_client.delete(RETRAIN_PENDING_KEY)
+
+            user_ids, users_interests = await load_users_interests(max_user_id)
+            if len(user_ids) <= 1:
+                return
+
+            await cache_client.hincrby(RETRAIN_METRICS_KEY, 'runs', 1)
+            logger.info('Переобучение модели рекомендаций: %s', await get_retrain_metrics(cache_client))
+
+            await _train_and_publish(cache_client, lock, user_ids, users_interests)
+
+    # Пользователи, зарегистрированные во время обучения, могли быть добавлены в прежнюю модель
+    for user_id in await User.filter(id__gt=max_user_id).values_list('id', flat=True):
+        await fold_in_user.kiq(user_id)
+
+
+async def _heartbeat(cache_client: redis.Redis, lock: Lock, started_at: float) -> None:
+    """Обновление отметки о ходе обучения и продление блокировки переобучения.
+
+    :param cache_client: Клиент Redis.
+    :param lock: Блокировка переобучения.
+    :param started_at: Время начала расчета.
+    """
+    await cache_client.hset(RETRAIN_HEARTBEAT_KEY, mapping={'started_at': started_at, 'updated_at': time.time()})
+    await cache_client.expire(RETRAIN_HEARTBEAT_KEY, recommendation_settings.retrain_timeout)
+    await lock.reacquire()
+
+
+async def _run_with_heartbeat(
+    cache_client: redis.Redis,
+    lock: Lock,
+    func: Callable[..., Any],
+    *args: Any,
+    in_thread: bool = False,
+    **kwargs: Any,
+) -> Any:
+    """Выполнение расчета в пуле обучения с сигналом о ходе выполнения.
+
+    Пока расчет идет, цикл событий воркера свободен для других задач, а раз в
+    `heartbeat_interval` секунд обновляется отметка о ходе обучения и
+    продлевается блокировка переобучения.
+
+    :param cache_client: Клиент Redis.
+    :param lock: Блокировка переобучения.
+    :param func: Функция расчета.
+    :param in_thread: Выполнить расчет в потоке текущего процесса, а не в пуле обучения:
+        аргументы не копируются в процесс пула.
+    :return: Результат функции.
+    """
+    loop = asyncio.get_running_loop()
+    executor = None if in_thread else get_training_executor()
+    future = loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    started_at = time.time()
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=recommendation_settings.heartbeat_interval)
+        if done:
+            return future.result()
+
+        await _heartbeat(cache_client, lock, started_at)
+        logger.info('Обучение модели рекомендаций выполняется %.0f с', time.time() - started_at)
 
-    user_interests_list = list(users_interests_map.values())
-    user_interests_array = np.array(user_interests_list)
 
-    processor = RecommendationsProcessor(
-        user_interests_array,
-        **recommendation_settings.model_dump(mode='python', include={'k', 'steps', 'alpha', 'reg_param', 'verbose'}),
+async def _load_warm_start(
+    cache_client: redis.Redis,
+    user_ids: np.ndarray,
+) -> tuple[np.ndarray | None, np.ndarray | None]:
+    """Получение начальных матриц из опубликованной модели.
+
+    Строки пользователей сопоставляются по идентификаторам: удаленные
+    пользователи отбрасываются, для новых строки заполняются NaN и
+    инициализируются случайно. Пользователи, добавленные в модель без
+    переобучения, используются наравне с остальными.
+
+    :param cache_client: Клиент Redis.
+    :param user_ids: Идентификаторы обучаемых пользователей.
+    :return: Начальные матрицы P и Q или None, если модель не опубликована.
+    """
+    snapshot = await get_model_snapshot(cache_client, MODEL_KEY, 'P', 'Q', 'user_ids')
+    if snapshot is None:
+        return None, None
+
+    version, (raw_P, raw_Q, raw_user_ids) = snapshot
+    P, previous_user_ids = decode_matrix(raw_P), decode_matrix(raw_user_ids)
+
+    folded = await get_folded(cache_client, version, get_folded_dtype(P.dtype, P.shape[1]))
+    if folded is not None and folded[1] is not None:
+        P = np.concatenate([P, folded[1]['vector']])
+        previous_user_ids = np.concatenate([previous_user_ids, folded[1]['user_id']])
+
+    initial_P = RecommendationsProcessor.align_rows(P, previous_user_ids, user_ids)
+    return initial_P, decode_matrix(raw_Q).astype(np.float64)
+
+
+async def _train_and_publish(
+    cache_client: redis.Redis,
+    lock: Lock,
+    user_ids: np.ndarray,
+    users_interests: np.ndarray,
+) -> None:
+    """Обучение модели рекомендаций и публикация ее в Redis.
+
+    :param cache_client: Клиент Redis.
+    :param lock: Блокировка переобучения.
+    :param user_ids: Идентификаторы пользователей.
+    :param users_interests: Матрица интересов пользователей.
+    """
+    initial_P, initial_Q = None, None
+    if recommendation_settings.warm_start:
+        initial_P, initial_Q = await _load_warm_start(cache_client, user_ids)
+
+    stored_recommendations, Q, n_iter, loss = await _run_with_heartbeat(
+        cache_client,
+        lock,
+        RecommendationsProcessor.factorize,
+        users_interests,
+        initial_P=initial_P,
+        initial_Q=initial_Q,
+        **recommendation_settings.model_dump(
+            mode='python',
+            include={'k', 'steps', 'alpha', 'reg_param', 'verbose', 'solver', 'tol', 'seed'},
+        ),
     )
-    stored_recommendations = processor.P
+    logger.info('Модель рекомендаций обучена: итераций %s, ошибка %s', n_iter, loss)
 
-    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
-        await cache_client.set('recommendations', json.dumps(stored_recommendations.tolist()))
-        await cache_client.set('user_map', json.dumps(user_id_position_map))
+    index = None
+    if recommendation_settings.ann_enabled:
+        index = await _run_with_heartbeat(
+            cache_client,
+            lock,
+            LSHIndex.build,
+            RecommendationsProcessor.normalize(stored_recommendations),
+            tables=recommendation_settings.ann_tables,
+            bits=recommendation_settings.ann_bits,
+            probes=recommendation_settings.ann_probes,
+            seed=recommendation_settings.seed,
+        )
+
+    # Данные пишутся в ключи новой версии, которую читатели не видят до переключения указателя.
+    # До публикации ключи ограничены по времени, чтобы упавшая задача не оставила их навсегда
+    version = await cache_client.incr(MODEL_SEQUENCE_KEY)
+    model_key, rows_key, neighbors_key, _ = get_model_keys(version)
+
+    async with cache_client.pipeline(transaction=False) as pipe:
+        pipe.hset(model_key, mapping={
+            'revision': 0,
+            'folded': 0,
+            'P': encode_matrix(stored_recommendations, recommendation_settings.storage_dtype),
+            'Q': encode_matrix(Q, recommendation_settings.storage_dtype),
+            'user_ids': encode_matrix(user_ids),
+            **({'index': encode_matrix(index.hyperplanes)} if index is not None else {}),
+        })
+        pipe.hset(rows_key, mapping=dict(zip(user_ids.tolist(), range(len(user_ids)))))
+        for key in (model_key, rows_key):
+            pipe.expire(key, recommendation_settings.retrain_timeout)
+        await pipe.execute()
+
+    if recommendation_settings.precompute_neighbors:
+        # Списки похожих пользователей считаются частями, чтобы не держать в памяти матрицу N x N,
+        # и записываются по мере расчета. Части считаются в потоке: умножение матриц освобождает GIL,
+        # а матрица и индекс не копируются в пул процессов для каждой части. Во время записи
+        # блокировка переобучения продлевается раз в `heartbeat_interval` секунд: расчет и запись
+        # списков занимают больше времени, чем обучение
+        P_normalized = index.vectors if index is not None else RecommendationsProcessor.normalize(stored_recommendations)
+        started_at = heartbeat_at = time.time()
+        for start in range(0, len(user_ids), recommendation_settings.neighbors_chunk_size):
+            chunk_rows, chunk_neighbors_rows, chunk_scores = await _run_with_heartbeat(
+                cache_client,
+                lock,
+                RecommendationsProcessor.neighbors_chunk,
+                P_normalized,
+                start,
+                start + recommendation_settings.neighbors_chunk_size,
+                top_n=recommendation_settings.neighbors_count,
+                batch_size=recommendation_settings.batch_size,
+                index=index,
+                normalized=True,
+                in_thread=True,
+            )
+            for block_start in range(0, len(chunk_rows), recommendation_settings.batch_size):
+                block = slice(block_start, block_start + recommendation_settings.batch_size)
+                async with cache_client.pipeline(transaction=False) as pipe:
+                    pipe.hset(neighbors_key, mapping={
+                        int(user_ids[row]): encode_neighbors(user_ids[row_neighbors], row_scores)
+                        for row, row_neighbors, row_scores in zip(
+                            chunk_rows[block],
+                            chunk_neighbors_rows[block],
+                            chunk_scores[block],
+                        )
+                    })
+                    for key in (model_key, rows_key, neighbors_key):
+                        pipe.expire(key, recommendation_settings.retrain_timeout)
+                    await pipe.execute()
+
+                if time.time() - heartbeat_at >= recommendation_settings.heartbeat_interval:
+                    await _heartbeat(cache_client, lock, started_at)
+                    heartbeat_at = time.time()
+
+    await _publish_version(cache_client, version)
+
+
+async def _publish_version(cache_client: redis.Redis, version: int) -> None:
+    """Переключение указателя на новую версию модели.
+
+    Указатель переключается одной транзакцией со снятием ограничения по
+    времени с ключей новой версии. Ключи прежней версии удаляются через
+    `version_grace_period` секунд, чтобы запросы, уже читающие ее, успели
+    завершиться.
+
+    :param cache_client: Клиент Redis.
+    :param version: Публикуемая версия.
+    """
+    async with cache_client.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(MODEL_VERSION_KEY)
+                previous_version = await pipe.get(MODEL_VERSION_KEY)
+
+                pipe.multi()
+                pipe.set(MODEL_VERSION_KEY, version)
+                for key in get_model_keys(version):
+                    pipe.persist(key)
+                if previous_version is not None:
+                    for key in get_model_keys(int(previous_version)):
+                        pipe.expire(key, recommendation_settings.version_grace_period)
+                await pipe.execute()
+                break
+            except WatchError:
+                continue
+
+    logger.info('Опубликована версия модели рекомендаций %s', version)
 
 
 @taskiq_broker.task
-async def process_users_info() -> None:
-    """Обработка пользовательской информации."""
-    users_interests: dict[int, dict[str, int]] = dict(
-        await User.all().order_by('id').values_list('id', 'interests')
-    )
+async def fold_in_user(user_id: int) -> None:
+    """Добавление нового пользователя в опубликованную модель без полного переобучения.
+
+    Вектор пользователя рассчитывается по зафиксированной матрице интересов Q
+    и дописывается в конец записей версии вместе со списком похожих
+    пользователей, поэтому матрица версии не перечитывается и не
+    перезаписывается. Когда доля таких пользователей превышает
+    `retrain_drift`, запускается полное переобучение.
 
-    if len(users_interests) == 1:
+    :param user_id: Идентификатор пользователя.
+    """
+    user = await User.get_or_none(id=user_id)
+    if user is None:
         return
 
-    interests_arrays_by_user_id_map: dict[int, list[int]] = {}
+    user_interests_array = np.array([get_interests_vector(user.interests)])
+
+    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+        async with cache_client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Публикация новой версии и параллельные добавления пользователей не должны затирать друг друга
+                    await pipe.watch(MODEL_VERSION_KEY)
+                    version = await pipe.get(MODEL_VERSION_KEY)
+                    if version is None:
+                        # Модель еще не обучена, пользователь попадет в нее при обучении
+                        await request_retrain()
+                        return
+
+                    model_key, rows_key, neighbors_key, folded_key = get_model_keys(int(version))
+                    await pipe.watch(model_key)
+
+                    # Строка читается из опубликованной версии; ее смена прервет транзакцию
+                    if await get_user_row(cache_client, user_id) is not None:
+                        return
+
+                    model = await model_cache.get(cache_client)
+                    if model is None or model.version != int(version):
+                        await pipe.reset()
+                        continue
+
+                    raw_Q, raw_folded_users_count = await pipe.hmget(model_key, 'Q', 'folded')
+                    user_vector = RecommendationsProcessor.fold_in(
+                        decode_matrix(raw_Q),
+                        user_interests_array,
+                        reg_param=recommendation_settings.reg_param,
+                    )[0].astype(model.P.dtype)
+                    users_count = len(model.user_ids) + int(raw_folded_users_count or 0) + 1
+
+                    # Запись, строка и номер изменения меняются вместе одной командой
+                    pipe.multi()
+                    pipe.append(folded_key, encode_folded(user_id, user_vector))
+                    pipe.hset(rows_key, str(user_id), users_count - 1)
+
+                    if recommendation_settings.precompute_neighbors:
+                        neighbors_user_ids, scores = model.search(
+                            RecommendationsProcessor.normalize(user_vector[None])[0],
+                            top_n=recommendation_settings.neighbors_count,
+                        )
+                        pipe.hset(neighbors_key, str(user_id), encode_neighbors(neighbors_user_ids, scores))
+
+                    pipe.hincrby(model_key, 'folded', 1)
+                    pipe.hincrby(model_key, 'revision', 1)
+                    *_, folded_users_count, _ = await pipe.execute()
+                    break
+                except WatchError:
+                    continue
+
+    if folded_users_count > recommendation_settings.retrain_drift * users_count:
+        await request_retrain()
+
+
+@taskiq_broker.task(schedule=[{'cron': recommendation_settings.retrain_cron}])
+async def process_users_info() -> None:
+    """Обработка пользовательской информации."""
+    # Запросы на переобучение, пришедшие за время ожидания, объединяются с этим запуском
+    await asyncio.sleep(recommendation_settings.retrain_debounce)
+
+    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+        logger.info('Кэш пользователей: %s', await get_user_cache_metrics(cache_client))
 
-    for user_id, user_interest in users_interests.items():
-        interests_arrays_by_user_id_map[user_id] = [
-            user_interest.get(interest_key)
-            for interest_key in settings.INTERESTS_KEYS
-        ]
+        max_user_id = await User.all().order_by('-id').first().values_list('id', flat=True)
+        if max_user_id is None:
+            await cache_client.delete(RETRAIN_PENDING_KEY)
+            return
 
-    await process_recommendations.kiq(interests_arrays_by_user_id_map)
+    await process_recommendations.kiq({'max_user_id': max_user_id})
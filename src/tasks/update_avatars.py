@@ -1,15 +1,104 @@
+import logging
+
+import redis.asyncio as redis
+from tortoise import timezone
+
 from broker import taskiq_broker
+from config import get_avatar_settings
 from models import User
-from utils.avatar import get_avatar_url
+from utils.avatar import AVATAR_FETCH_ERRORS, AvatarFetcher
+from utils.users import invalidate_users
+
+logger = logging.getLogger(__name__)
+
+avatar_settings = get_avatar_settings()
+
+AVATAR_PENDING_KEY = 'avatars:pending:{user_id}'
+
+
+async def request_avatar_update(user_id: int) -> bool:
+    """Запрос получения аватара пользователя.
+
+    Пока задача для пользователя ожидает выполнения или выполняется,
+    повторные запросы не ставят новую задачу.
+
+    :param user_id: Идентификатор пользователя.
+    :return: Поставлена ли задача в очередь.
+    """
+    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+        # Флаг ограничен по времени, чтобы упавшая задача не заблокировала обновление навсегда
+        scheduled = await cache_client.set(
+            AVATAR_PENDING_KEY.format(user_id=user_id),
+            1,
+            nx=True,
+            ex=avatar_settings.avatar_pending_ttl,
+        )
+
+    if not scheduled:
+        return False
+
+    await update_user_avatar.kiq(user_id)
+    return True
+
+
+@taskiq_broker.task
+async def update_user_avatar(user_id: int) -> None:
+    """Обновление ссылки на аватар пользователя.
+
+    :param user_id: Идентификатор пользователя.
+    """
+    async with redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client:
+        try:
+            user = await User.get_or_none(id=user_id)
+            if user is None:
+                return
+
+            async with AvatarFetcher(cache_client=cache_client) as fetcher:
+                try:
+                    result = await fetcher.resolve(user.telegram_link)
+                except AVATAR_FETCH_ERRORS as error:
+                    logger.warning('Не удалось получить аватар %s: %r', user.telegram_link, error)
+                    return
+
+            if result.avatar_url != user.avatar_url:
+                # Обновление без сохранения модели: сигналы сохранения пользователя не срабатывают повторно.
+                # Время изменения обновляется явно, от него зависит ETag профиля
+                await User.filter(id=user_id).update(avatar_url=result.avatar_url, updated_at=timezone.now())
+                await invalidate_users(cache_client, [user_id])
+        finally:
+            await cache_client.delete(AVATAR_PENDING_KEY.format(user_id=user_id))
 
 
 @taskiq_broker.task
 async def update_users_avatars():
-    """Обновление ссылок на пользовательские аватары."""
-    updated_users = []
-    async for user in User.filter():
-        user: User
-        user.avatar_url = await get_avatar_url(user.telegram_link)
-        updated_users.append(user)
-
-    await User.bulk_update(updated_users, fields=['avatar_url'])
+    """Обновление ссылок на пользовательские аватары.
+
+    Пользователи читаются пачками по возрастанию id, аватары пачки
+    запрашиваются параллельно, а в БД записываются только изменившиеся
+    ссылки. Ссылки пользователей, для которых запрос не удался, не меняются.
+    """
+    updated_users_count = 0
+    async with (
+        redis.Redis(connection_pool=taskiq_broker.connection_pool) as cache_client,
+        AvatarFetcher(cache_client=cache_client) as fetcher,
+    ):
+        last_user_id = 0
+        while users := await User.filter(id__gt=last_user_id).order_by('id').limit(avatar_settings.avatar_batch_size):
+            results = await fetcher.fetch_many([user.telegram_link for user in users])
+
+            updated_users = []
+            updated_at = timezone.now()
+            for user, result in zip(users, results):
+                if result is not None and result.avatar_url != user.avatar_url:
+                    user.avatar_url = result.avatar_url
+                    user.updated_at = updated_at
+                    updated_users.append(user)
+
+            if updated_users:
+                # bulk_update не обновляет время изменения сам, от него зависит ETag профиля
+                await User.bulk_update(updated_users, fields=['avatar_url', 'updated_at'])
+                await invalidate_users(cache_client, [user.id for user in updated_users])
+            updated_users_count += len(updated_users)
+            last_user_id = users[-1].id
+
+    logger.info('Обновлены аватары пользователей: %s', updated_users_count)
@@ -1,6 +1,9 @@
 import datetime
+from collections import OrderedDict
 from functools import cached_property
 import hashlib
+import threading
+import time
 import jwt
 
 from config import get_auth_settings
@@ -27,6 +30,52 @@ def _generate_token_exp():
     ).timestamp()
 
 
+class TokenCache:
+    """Кэш проверенных токенов в памяти процесса.
+
+    Наполнение токена хранится до истечения его срока действия (`exp`),
+    поэтому повторные запросы с тем же токеном не проверяют подпись заново.
+    Размер кэша ограничен, при переполнении вытесняются давно не
+    использованные токены. Некорректные токены не кэшируются.
+    """
+
+    def __init__(self, maxsize: int = auth_settings.TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        # токен -> (срок действия, наполнение токена)
+        self._tokens: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # Кэш может использоваться и из потоков, например, в синхронных обработчиках
+        self._lock = threading.Lock()
+
+    def decode(self, token: str) -> dict:
+        """Проверка и декодирование токена.
+
+        :param token: Авторизационный токен.
+        :raises jwt.InvalidTokenError: Токен некорректен или истек.
+        :return: Наполнение токена.
+        """
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._tokens.move_to_end(token)
+                    return entry[1]
+                del self._tokens[token]
+
+        body = jwt.decode(token, auth_settings.SECRET_KEY, algorithms=[auth_settings.ALGORITHM])
+        if 'exp' not in body:
+            return body
+
+        with self._lock:
+            self._tokens[token] = (float(body['exp']), body)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+        return body
+
+
+token_cache = TokenCache()
+
+
 class Token:
     """Логика для токена авторизации."""
 
@@ -48,7 +97,7 @@ class Token:
     @cached_property
     def body(self):
         """Получение наполнения токена."""
-        return jwt.decode(self.token, auth_settings.SECRET_KEY, algorithms=[auth_settings.ALGORITHM])
+        return token_cache.decode(self.token)
 
     @property
     def username(self):
@@ -1,19 +1,283 @@
-from httpx import AsyncClient
-from bs4 import BeautifulSoup
+import asyncio
+import codecs
+import json
+import logging
+from collections import defaultdict
+from html.parser import HTMLParser
+from typing import NamedTuple
+from urllib.parse import urlsplit
 
+import redis.asyncio as redis
+from httpx import AsyncClient, HTTPError, HTTPStatusError, InvalidURL, Limits, Response, Timeout, codes
 
-async def get_avatar_url(telegram_link: str) -> str | None:
-    """Получение URL аватара из telegram.
+from config import get_avatar_settings
 
-    :param telegram_link: URL Telegram.
-    :return: URL аватара пользователя.
+logger = logging.getLogger(__name__)
+
+avatar_settings = get_avatar_settings()
+
+AVATAR_VALIDATORS_KEY = 'avatars:validators:{telegram_link}'
+# Недавние результаты: повторный запрос по ссылке в течение `avatar_result_ttl` не отправляется
+AVATAR_RESULT_KEY = 'avatars:result:{telegram_link}'
+
+# Ошибки получения аватара по одной ссылке: ошибки запроса и некорректные ссылки пользователей
+AVATAR_FETCH_ERRORS = (HTTPError, InvalidURL, ValueError)
+
+
+class AvatarResult(NamedTuple):
+    """Результат получения аватара и валидаторы ответа для условных запросов."""
+
+    avatar_url: str | None
+    etag: str | None = None
+    last_modified: str | None = None
+
+    def dumps(self) -> str:
+        """Сериализация результата для кэша."""
+        return json.dumps(self._asdict())
+
+    @classmethod
+    def loads(cls, raw: bytes | str) -> "AvatarResult":
+        """Десериализация результата из кэша."""
+        return cls(**json.loads(raw))
+
+
+class AvatarExtractor(HTMLParser):
+    """Инкрементальный поиск мета-тега og:image.
+
+    Страница подается частями по мере загрузки. Разбор заканчивается на
+    найденном теге, на конце заголовка страницы или на начале тела, так как
+    мета-теги находятся только в заголовке.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.avatar_url: str | None = None
+        self.done = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag == 'meta':
+            attributes = dict(attrs)
+            if attributes.get('property') == 'og:image':
+                self.avatar_url = attributes.get('content')
+                self.done = True
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'head':
+            self.done = True
+
+    def feed(self, data: str) -> None:
+        if not self.done:
+            super().feed(data)
+
+
+def parse_avatar_url(html: str) -> str | None:
+    """Получение URL аватара из страницы Telegram.
+
+    :param html: HTML страницы.
+    :return: URL аватара из мета-тега og:image.
     """
-    async with AsyncClient() as client:
-        response = await client.get(telegram_link)
-        html = str(response.content)
+    extractor = AvatarExtractor()
+    extractor.feed(html)
+    return extractor.avatar_url
+
+
+async def read_avatar_url(response: Response) -> str | None:
+    """Получение URL аватара из потокового ответа.
+
+    Ответ читается до конца заголовка страницы, но не более `avatar_max_bytes`.
+    Небольшой остаток ответа (до `avatar_drain_bytes`) дочитывается без
+    разбора, чтобы соединение вернулось в пул; большой - не читается, и
+    соединение закрывается.
+
+    :param response: Ответ, открытый через `AsyncClient.stream`.
+    :return: URL аватара из мета-тега og:image.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(response.charset_encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    extractor = AvatarExtractor()
+    async for chunk in response.aiter_bytes():
+        if not extractor.done:
+            extractor.feed(decoder.decode(chunk))
+            extractor.done = extractor.done or response.num_bytes_downloaded >= avatar_settings.avatar_max_bytes
+
+        if extractor.done:
+            content_length = response.headers.get('Content-Length')
+            remaining = int(content_length) - response.num_bytes_downloaded if content_length else None
+            if remaining is None or remaining > avatar_settings.avatar_drain_bytes:
+                break
+
+    return extractor.avatar_url
+
+
+def create_avatar_client() -> AsyncClient:
+    """Создание HTTP-клиента с общим пулом соединений и ограничениями по времени."""
+    return AsyncClient(
+        limits=Limits(
+            max_connections=avatar_settings.avatar_max_connections,
+            max_keepalive_connections=avatar_settings.avatar_max_connections,
+        ),
+        timeout=Timeout(avatar_settings.avatar_timeout, connect=avatar_settings.avatar_connect_timeout),
+        follow_redirects=True,
+    )
+
+
+class AvatarFetcher:
+    """Получение аватаров пользователей с ограничением параллельности.
+
+    Все запросы идут через один HTTP-клиент, поэтому соединения с хостом
+    переиспользуются. Количество одновременных запросов ограничено как в
+    целом, так и для каждого хоста. Если в кэше есть результат прежнего
+    запроса, запрос отправляется условным (If-None-Match / If-Modified-Since)
+    и ответ 304 не требует разбора страницы.
+    """
+
+    def __init__(
+        self,
+        cache_client: redis.Redis | None = None,
+        client: AsyncClient | None = None,
+        concurrency: int = avatar_settings.avatar_concurrency,
+        host_concurrency: int = avatar_settings.avatar_host_concurrency,
+    ):
+        """
+        :param cache_client: Клиент Redis для хранения валидаторов. Без него запросы не условные.
+        :param client: HTTP-клиент. По умолчанию создается при входе в контекст и закрывается при выходе.
+        :param concurrency: Максимальное количество одновременных запросов.
+        :param host_concurrency: Максимальное количество одновременных запросов к одному хосту.
+        """
+        self.cache_client = cache_client
+        self.client = client
+        self._owns_client = client is None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._host_semaphores: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(host_concurrency),
+        )
+
+    async def __aenter__(self) -> "AvatarFetcher":
+        if self.client is None:
+            self.client = create_avatar_client()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._owns_client:
+            await self.client.aclose()
+            self.client = None
+
+    async def fetch(self, telegram_link: str, previous: AvatarResult | None = None) -> AvatarResult:
+        """Получение аватара по ссылке Telegram.
+
+        :param telegram_link: URL Telegram.
+        :param previous: Результат прежнего запроса.
+        :raises HTTPError: Ошибка запроса или ответ с кодом ошибки.
+        :raises InvalidURL: Некорректная ссылка.
+        :raises ValueError: Ссылку не удалось разобрать.
+        :return: Результат запроса.
+        """
+        headers = {}
+        if previous is not None:
+            if previous.etag:
+                headers['If-None-Match'] = previous.etag
+            if previous.last_modified:
+                headers['If-Modified-Since'] = previous.last_modified
+
+        async with (
+            self._semaphore,
+            self._host_semaphores[urlsplit(telegram_link).hostname or ''],
+            self.client.stream('GET', telegram_link, headers=headers) as response,
+        ):
+            if response.status_code == codes.NOT_MODIFIED and previous is not None:
+                return previous
+
+            response.raise_for_status()
+            return AvatarResult(
+                await read_avatar_url(response),
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+            )
+
+    async def fetch_many(self, telegram_links: list[str]) -> list[AvatarResult | None]:
+        """Параллельное получение аватаров.
+
+        :param telegram_links: URL Telegram.
+        :return: Результаты в порядке ссылок; None, если аватар получить не удалось.
+        """
+        previous_results = [None] * len(telegram_links)
+        if self.cache_client is not None and telegram_links:
+            raw_results = await self.cache_client.mget([
+                AVATAR_VALIDATORS_KEY.format(telegram_link=telegram_link) for telegram_link in telegram_links
+            ])
+            previous_results = [AvatarResult.loads(raw) if raw is not None else None for raw in raw_results]
+
+        results = await asyncio.gather(
+            *(self.fetch(link, previous) for link, previous in zip(telegram_links, previous_results)),
+            return_exceptions=True,
+        )
+
+        fetched: list[AvatarResult | None] = []
+        for telegram_link, result in zip(telegram_links, results):
+            if isinstance(result, AVATAR_FETCH_ERRORS):
+                logger.warning('Не удалось получить аватар %s: %r', telegram_link, result)
+                result = None
+            elif isinstance(result, BaseException):
+                raise result
+            fetched.append(result)
+
+        if self.cache_client is not None:
+            async with self.cache_client.pipeline(transaction=False) as pipe:
+                for telegram_link, result in zip(telegram_links, fetched):
+                    if result is not None and (result.etag or result.last_modified):
+                        pipe.set(
+                            AVATAR_VALIDATORS_KEY.format(telegram_link=telegram_link),
+                            result.dumps(),
+                            ex=avatar_settings.avatar_validators_ttl,
+                        )
+                await pipe.execute()
+
+        return fetched
+
+    async def resolve(self, telegram_link: str) -> AvatarResult:
+        """Получение аватара с кэшированием недавних результатов и повторными попытками.
+
+        Ошибки соединения и ответы 429 и 5xx повторяются с экспоненциально
+        растущей задержкой, остальные ошибки возвращаются сразу.
+
+        :param telegram_link: URL Telegram.
+        :raises HTTPError: Аватар не удалось получить за все попытки.
+        :raises InvalidURL: Некорректная ссылка, запрос не повторяется.
+        :raises ValueError: Ссылку не удалось разобрать, запрос не повторяется.
+        :return: Результат запроса.
+        """
+        result_key = AVATAR_RESULT_KEY.format(telegram_link=telegram_link)
+        validators_key = AVATAR_VALIDATORS_KEY.format(telegram_link=telegram_link)
+
+        previous = None
+        if self.cache_client is not None:
+            raw_result, raw_previous = await self.cache_client.mget(result_key, validators_key)
+            if raw_result is not None:
+                return AvatarResult.loads(raw_result)
+            previous = AvatarResult.loads(raw_previous) if raw_previous is not None else None
+
+        for attempt in range(avatar_settings.avatar_retries + 1):
+            try:
+                result = await self.fetch(telegram_link, previous)
+                break
+            except HTTPError as error:
+                retryable = not isinstance(error, HTTPStatusError) or (
+                    error.response.status_code == codes.TOO_MANY_REQUESTS or error.response.is_server_error
+                )
+                if not retryable or attempt == avatar_settings.avatar_retries:
+                    raise
+                await asyncio.sleep(avatar_settings.avatar_retry_delay * 2 ** attempt)
 
-        soup = BeautifulSoup(html)
-        image_meta = soup.find('meta', property='og:image')
+        if self.cache_client is not None:
+            async with self.cache_client.pipeline(transaction=False) as pipe:
+                pipe.set(result_key, result.dumps(), ex=avatar_settings.avatar_result_ttl)
+                if result.etag or result.last_modified:
+                    pipe.set(validators_key, result.dumps(), ex=avatar_settings.avatar_validators_ttl)
+                await pipe.execute()
 
-        if image_meta:
-            return image_meta['content']
+        return result
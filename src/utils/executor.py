@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+from config import get_recommendations_settings
+
+recommendations_settings = get_recommendations_settings()
+
+BLAS_THREADS_VARIABLES = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+
+def limit_blas_threads(threads: int) -> None:
+    """Ограничение количества потоков BLAS в процессе.
+
+    Действует, только если numpy еще не импортирован, поэтому вызывается при
+    старте процесса пула.
+
+    :param threads: Количество потоков.
+    """
+    for variable in BLAS_THREADS_VARIABLES:
+        os.environ[variable] = str(threads)
+
+
+@lru_cache
+def get_training_executor() -> Executor:
+    """Получение пула для расчетов обучения модели рекомендаций.
+
+    Пул процессов запускается методом spawn, чтобы ограничение потоков BLAS
+    применилось до импорта numpy. В пуле потоков используется BLAS текущего
+    процесса без ограничений.
+    """
+    if recommendations_settings.executor == 'thread':
+        return ThreadPoolExecutor(
+            max_workers=recommendations_settings.executor_workers,
+            thread_name_prefix='recommendations',
+        )
+
+    return ProcessPoolExecutor(
+        max_workers=recommendations_settings.executor_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=limit_blas_threads,
+        initargs=(recommendations_settings.blas_threads,),
+    )
@@ -0,0 +1,15 @@
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Проверка заголовка If-None-Match.
+
+    ETag сравниваются слабым сравнением: префикс W/ не учитывается, `*`
+    совпадает с любым ETag.
+
+    :param if_none_match: Значение заголовка.
+    :param etag: ETag ответа.
+    :return: Совпадает ли один из ETag заголовка с ETag ответа.
+    """
+    if not if_none_match:
+        return False
+
+    candidates = {candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')}
+    return '*' in candidates or etag.removeprefix('W/') in candidates
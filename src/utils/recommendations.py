@@ -0,0 +1,808 @@
+import asyncio
+import base64
+import copy
+import binascii
+import hashlib
+import math
+import struct
+import time
+from typing import NamedTuple
+
+import numpy as np
+import redis.asyncio as redis
+
+from config import get_recommendations_settings
+from processors.ann import LSHIndex
+from processors.matrix_factorization import RecommendationsProcessor
+
+recommendations_settings = get_recommendations_settings()
+
+# Указатель на опубликованную версию модели и счетчик выданных версий
+MODEL_VERSION_KEY = 'recommendations:version'
+MODEL_SEQUENCE_KEY = 'recommendations:sequence'
+# Ключи версии модели: хэш с матрицами, хэши строк пользователей и списков похожих пользователей
+MODEL_KEY = 'recommendations:model:{version}'
+USER_ROWS_KEY = 'recommendations:model:{version}:rows'
+NEIGHBORS_KEY = 'recommendations:model:{version}:neighbors'
+# Пользователи, добавленные в версию модели без переобучения: записи (user_id, вектор)
+# дописываются в конец строки, поэтому добавление не зависит от размера модели
+FOLDED_KEY = 'recommendations:model:{version}:folded'
+# Готовый ответ со списком рекомендаций пользователя и обратный индекс:
+# рекомендуемый пользователь -> пользователи, в чьих ответах он есть
+RENDERED_KEY = 'recommendations:rendered:{user_id}'
+RENDERED_BY_KEY = 'recommendations:rendered:by:{user_id}'
+# Пользователи, исключенные из рекомендаций пользователя (просмотренные или скрытые): множество id
+EXCLUSIONS_KEY = 'recommendations:exclusions:{user_id}'
+RETRAIN_PENDING_KEY = 'recommendations:retrain:pending'
+RETRAIN_LOCK_KEY = 'recommendations:retrain:lock'
+RETRAIN_METRICS_KEY = 'recommendations:retrain:metrics'
+RETRAIN_HEARTBEAT_KEY = 'recommendations:retrain:heartbeat'
+
+NEIGHBORS_DTYPE = np.dtype([('user_id', '<i4'), ('score', '<f4')])
+
+# Поля хэша версии модели, не меняющиеся до публикации новой версии
+MODEL_FIELDS = ('P', 'user_ids', 'index')
+
+# Чтение полей хэша опубликованной версии за один запрос: указатель и данные
+# читаются атомарно, поэтому переключение версии не может попасть между ними.
+# Ключ версии вычисляется в скрипте, поэтому скрипт не совместим с Redis Cluster
+MODEL_SNAPSHOT_SCRIPT = '''
+local version = redis.call('GET', KEYS[1])
+if not version then
+    return false
+end
+local key = string.gsub(ARGV[1], '{version}', version)
+local values = redis.call('HMGET', key, unpack(ARGV, 2))
+table.insert(values, 1, version)
+return values
+'''
+
+# Чтение номера изменения опубликованной версии и добавленных в нее пользователей,
+# начиная с указанной позиции (в байтах). Если версия отличается от ожидаемой,
+# пользователи не возвращаются
+FOLDED_SCRIPT = '''
+local version = redis.call('GET', KEYS[1])
+if not version then
+    return false
+end
+local model_key = string.gsub(ARGV[1], '{version}', version)
+local revision = redis.call('HGET', model_key, 'revision') or '0'
+if version ~= ARGV[3] then
+    return {version, revision, false}
+end
+local folded_key = string.gsub(ARGV[2], '{version}', version)
+return {version, revision, redis.call('GETRANGE', folded_key, ARGV[4], -1)}
+'''
+
+# Чтение опубликованной версии, ее номера изменения и готового ответа пользователя за один запрос
+RENDERED_SCRIPT = '''
+local version = redis.call('GET', KEYS[1])
+if not version then
+    return false
+end
+local key = string.gsub(ARGV[1], '{version}', version)
+local revision = redis.call('HGET', key, 'revision') or '0'
+local rendered = redis.call('HMGET', KEYS[2], 'stamp', 'etag', 'body', 'cursor')
+return {version, revision, rendered[1], rendered[2], rendered[3], rendered[4]}
+'''
+
+# Чтение части списка похожих пользователей: версия берется из курсора или из
+# указателя, с сервера передается только запрошенный диапазон байт и длина списка
+NEIGHBORS_PAGE_SCRIPT = '''
+local version = ARGV[2]
+if version == '' then
+    version = redis.call('GET', KEYS[1])
+    if not version then
+        return false
+    end
+end
+local key = string.gsub(ARGV[1], '{version}', version)
+local neighbors = redis.call('HGET', key, ARGV[3])
+if not neighbors then
+    return {version, false, 0}
+end
+return {version, string.sub(neighbors, ARGV[4] + 1, ARGV[4] + ARGV[5]), string.len(neighbors)}
+'''
+
+# Сохранение списка похожих пользователей, только если версия еще опубликована:
+# иначе ключи версии могли быть уже удалены, и запись создала бы их без срока жизни
+SET_NEIGHBORS_SCRIPT = '''
+if redis.call('GET', KEYS[1]) ~= ARGV[2] then
+    return 0
+end
+local key = string.gsub(ARGV[1], '{version}', ARGV[2])
+redis.call('HSET', key, ARGV[3], ARGV[4])
+return 1
+'''
+
+MATRIX_MAGIC = b'MDMX'
+MATRIX_FORMAT_VERSION = 1
+# magic, версия формата, код типа данных, число измерений; далее размеры по каждому измерению
+MATRIX_HEADER = struct.Struct('<4sBBBx')
+MATRIX_DIM = struct.Struct('<Q')
+MATRIX_DTYPES: dict[int, np.dtype] = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f2'),
+    3: np.dtype('<f8'),
+    4: np.dtype('<i4'),
+    5: np.dtype('<i8'),
+}
+MATRIX_DTYPE_CODES: dict[np.dtype, int] = {dtype: code for code, dtype in MATRIX_DTYPES.items()}
+
+
+def get_model_keys(version: int) -> tuple[str, str, str, str]:
+    """Получение ключей версии модели.
+
+    :param version: Версия модели.
+    :return: Ключ хэша модели, ключ строк пользователей, ключ списков похожих пользователей,
+        ключ пользователей, добавленных без переобучения.
+    """
+    return (
+        MODEL_KEY.format(version=version),
+        USER_ROWS_KEY.format(version=version),
+        NEIGHBORS_KEY.format(version=version),
+        FOLDED_KEY.format(version=version),
+    )
+
+
+async def get_model_snapshot(
+    cache_client: redis.Redis,
+    key: str,
+    *fields: str,
+) -> tuple[int, list[bytes | None]] | None:
+    """Чтение полей опубликованной версии модели за один запрос.
+
+    :param cache_client: Клиент Redis.
+    :param key: Шаблон ключа версии (`MODEL_KEY`, `USER_ROWS_KEY` или `NEIGHBORS_KEY`).
+    :param fields: Поля хэша.
+    :return: Версия модели и значения полей или None, если модель еще не опубликована.
+    """
+    snapshot = await cache_client.register_script(MODEL_SNAPSHOT_SCRIPT)(keys=[MODEL_VERSION_KEY], args=[key, *fields])
+    if snapshot is None:
+        return None
+
+    version, *values = snapshot
+    return int(version), values
+
+
+async def get_folded(
+    cache_client: redis.Redis,
+    version: int,
+    folded_dtype: np.dtype,
+    start: int = 0,
+) -> tuple[int, np.ndarray | None] | None:
+    """Чтение пользователей, добавленных в версию модели без переобучения.
+
+    :param cache_client: Клиент Redis.
+    :param version: Версия модели.
+    :param folded_dtype: Тип записи (`get_folded_dtype`).
+    :param start: Количество уже прочитанных записей.
+    :return: Номер изменения опубликованной версии и записи (user_id, vector), начиная со `start`;
+        записи - None, если опубликована другая версия; None, если модель еще не опубликована.
+    """
+    folded = await cache_client.register_script(FOLDED_SCRIPT)(
+        keys=[MODEL_VERSION_KEY],
+        args=[MODEL_KEY, FOLDED_KEY, version, start * folded_dtype.itemsize],
+    )
+    if folded is None:
+        return None
+
+    published_version, revision, raw_folded = folded
+    if raw_folded is None or int(published_version) != version:
+        return int(revision), None
+    return int(revision), np.frombuffer(raw_folded, dtype=folded_dtype)
+
+
+class PageCursor(NamedTuple):
+    """Курсор страницы рекомендаций."""
+
+    # Версия модели, по которой построен список
+    version: int
+    # Позиция начала страницы в списке
+    offset: int
+    # Последний пользователь предыдущей страницы и его оценка: по ним продолжается
+    # список, рассчитанный заново (например, после исключения просмотренных пользователей)
+    user_id: int | None = None
+    score: float | None = None
+
+
+def encode_cursor(version: int, offset: int, user_id: int, score: float) -> str:
+    """Получение курсора страницы рекомендаций.
+
+    :param version: Версия модели, по которой построен список.
+    :param offset: Позиция начала страницы в списке.
+    :param user_id: Идентификатор последнего пользователя предыдущей страницы.
+    :param score: Оценка последнего пользователя предыдущей страницы.
+    :return: Курсор.
+    """
+    return base64.urlsafe_b64encode(f'{version}:{offset}:{user_id}:{float(score)!r}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> PageCursor:
+    """Разбор курсора страницы рекомендаций.
+
+    :param cursor: Курсор.
+    :raises ValueError: Некорректный курсор.
+    :return: Курсор.
+    """
+    try:
+        parts = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':')
+        if len(parts) == 2:
+            page_cursor = PageCursor(int(parts[0]), int(parts[1]))
+        else:
+            version, offset, user_id, score = parts
+            page_cursor = PageCursor(int(version), int(offset), int(user_id), float(score))
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError('Некорректный курсор.') from error
+
+    if page_cursor.version < 1 or page_cursor.offset < 0 or (
+        page_cursor.score is not None and not math.isfinite(page_cursor.score)
+    ):
+        raise ValueError('Некорректный курсор.')
+    return page_cursor
+
+
+def get_ranked_offset(user_ids: np.ndarray, scores: np.ndarray, cursor: PageCursor) -> int:
+    """Получение позиции, с которой список продолжается после курсора.
+
+    Если последний пользователь предыдущей страницы есть в списке, список
+    продолжается после него. Иначе (пользователь исключен) - после всех
+    пользователей, стоящих в порядке (оценка по убыванию, id по возрастанию)
+    перед ним, поэтому исключение просмотренных пользователей не сдвигает
+    следующие страницы.
+
+    :param user_ids: Идентификаторы пользователей списка.
+    :param scores: Оценки пользователей по убыванию.
+    :param cursor: Курсор.
+    :return: Позиция начала страницы.
+    """
+    if cursor.user_id is None:
+        return cursor.offset
+
+    positions = np.flatnonzero(user_ids == cursor.user_id)
+    if len(positions):
+        return int(positions[0]) + 1
+    return int(np.count_nonzero((scores > cursor.score) | ((scores == cursor.score) & (user_ids < cursor.user_id))))
+
+
+async def get_neighbors_page(
+    cache_client: redis.Redis,
+    user_id: int,
+    offset: int,
+    limit: int,
+    version: int | None = None,
+) -> tuple[int, np.ndarray | None, int] | None:
+    """Чтение части списка похожих пользователей за один запрос.
+
+    :param cache_client: Клиент Redis.
+    :param user_id: Идентификатор пользователя.
+    :param offset: Позиция начала части.
+    :param limit: Размер части.
+    :param version: Версия модели. По умолчанию - опубликованная.
+    :return: Версия модели, записи (user_id, score) или None, если списка нет,
+        длина всего списка; None, если модель еще не опубликована.
+    """
+    page = await cache_client.register_script(NEIGHBORS_PAGE_SCRIPT)(
+        keys=[MODEL_VERSION_KEY],
+        args=[
+            NEIGHBORS_KEY,
+            version if version is not None else '',
+            user_id,
+            offset * NEIGHBORS_DTYPE.itemsize,
+            limit * NEIGHBORS_DTYPE.itemsize,
+        ],
+    )
+    if page is None:
+        return None
+
+    page_version, raw_neighbors, neighbors_size = page
+    if raw_neighbors is None:
+        return int(page_version), None, 0
+    return int(page_version), decode_neighbors(raw_neighbors), neighbors_size // NEIGHBORS_DTYPE.itemsize
+
+
+async def set_neighbors(cache_client: redis.Redis, version: int, user_id: int, neighbors: bytes) -> bool:
+    """Сохранение списка похожих пользователей в опубликованную версию модели.
+
+    :param cache_client: Клиент Redis.
+    :param version: Версия модели, по которой рассчитан список.
+    :param user_id: Идентификатор пользователя.
+    :param neighbors: Упакованный список.
+    :return: Сохранен ли список: версия может быть уже заменена новой.
+    """
+    stored = await cache_client.register_script(SET_NEIGHBORS_SCRIPT)(
+        keys=[MODEL_VERSION_KEY],
+        args=[NEIGHBORS_KEY, version, user_id, neighbors],
+    )
+    return bool(stored)
+
+
+def get_rendered_stamp(version: int, revision: int | None = None) -> str:
+    """Получение отметки версии модели, по которой построен готовый ответ.
+
+    Списки похожих пользователей версии не меняются при добавлении новых
+    пользователей, поэтому ответ из них отмечается только версией. Ответ,
+    рассчитанный по модели в памяти процесса, учитывает добавленных
+    пользователей и отмечается также номером изменения, как и пустой ответ
+    пользователю, которого еще нет в версии.
+
+    :param version: Версия модели.
+    :param revision: Номер изменения версии; None - ответ не зависит от изменений.
+    :return: Отметка.
+    """
+    return f'{version}' if revision is None else f'{version}.{revision}'
+
+
+async def get_rendered_recommendations(
+    cache_client: redis.Redis,
+    user_id: int,
+) -> tuple[int, int, str | None, bytes | None, str | None] | None:
+    """Получение готового ответа с первой страницей рекомендаций пользователя.
+
+    :param cache_client: Клиент Redis.
+    :param user_id: Идентификатор пользователя.
+    :return: Опубликованная версия модели, ее номер изменения, ETag, тело ответа и
+        курсор следующей страницы или None, если модель еще не опубликована. ETag и
+        тело - None, если ответа нет или он построен по другой версии модели.
+    """
+    rendered = await cache_client.register_script(RENDERED_SCRIPT)(
+        keys=[MODEL_VERSION_KEY, RENDERED_KEY.format(user_id=user_id)],
+        args=[MODEL_KEY],
+    )
+    if rendered is None:
+        return None
+
+    version, revision, rendered_stamp, etag, body, cursor = rendered
+    version, revision = int(version), int(revision)
+    stamps = {get_rendered_stamp(version), get_rendered_stamp(version, revision)}
+    if rendered_stamp is None or rendered_stamp.decode() not in stamps:
+        return version, revision, None, None, None
+    return version, revision, etag.decode(), body, cursor.decode() or None
+
+
+async def set_rendered_recommendations(
+    cache_client: redis.Redis,
+    user_id: int,
+    stamp: str,
+    body: bytes,
+    cursor: str | None,
+    recommended_user_ids: list[int],
+) -> str:
+    """Сохранение готового ответа с первой страницей рекомендаций пользователя.
+
+    :param cache_client: Клиент Redis.
+    :param user_id: Идентификатор пользователя.
+    :param stamp: Отметка версии модели, по которой построен ответ (`get_rendered_stamp`).
+    :param body: Тело ответа.
+    :param cursor: Курсор следующей страницы.
+    :param recommended_user_ids: Идентификаторы рекомендуемых пользователей.
+    :return: ETag ответа.
+    """
+    etag = f'"{stamp}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    rendered_key = RENDERED_KEY.format(user_id=user_id)
+
+    async with cache_client.pipeline(transaction=False) as pipe:
+        pipe.hset(rendered_key, mapping={'stamp': stamp, 'etag': etag, 'body': body, 'cursor': cursor or ''})
+        pipe.expire(rendered_key, recommendations_settings.rendered_ttl)
+        for recommended_user_id in recommended_user_ids:
+            rendered_by_key = RENDERED_BY_KEY.format(user_id=recommended_user_id)
+            pipe.sadd(rendered_by_key, user_id)
+            pipe.expire(rendered_by_key, recommendations_settings.rendered_ttl)
+        await pipe.execute()
+
+    return etag
+
+
+async def invalidate_rendered_recommendations(cache_client: redis.Redis, user_ids: list[int]) -> None:
+    """Удаление готовых ответов, в которых есть измененные пользователи.
+
+    :param cache_client: Клиент Redis.
+    :param user_ids: Идентификаторы измененных пользователей.
+    """
+    rendered_by_keys = [RENDERED_BY_KEY.format(user_id=user_id) for user_id in user_ids]
+    async with cache_client.pipeline(transaction=False) as pipe:
+        for rendered_by_key in rendered_by_keys:
+            pipe.smembers(rendered_by_key)
+        rendered_by = await pipe.execute()
+
+    rendered_keys = {RENDERED_KEY.format(user_id=int(user_id)) for members in rendered_by for user_id in members}
+    await cache_client.delete(*rendered_keys, *rendered_by_keys)
+
+
+async def add_exclusions(cache_client: redis.Redis, user_id: int, excluded_user_ids: list[int]) -> None:
+    """Исключение пользователей из рекомендаций пользователя.
+
+    Исключения упорядочены по времени добавления: сверх `exclusions_limit`
+    удаляются самые старые, а без новых исключений все они удаляются через
+    `exclusions_ttl` секунд.
+
+    :param cache_client: Клиент Redis.
+    :param user_id: Идентификатор пользователя.
+    :param excluded_user_ids: Идентификаторы исключаемых пользователей.
+    """
+    exclusions_key = EXCLUSIONS_KEY.format(user_id=user_id)
+    added_at = time.time()
+    async with cache_client.pipeline(transaction=True) as pipe:
+        pipe.zadd(exclusions_key, dict.fromkeys(excluded_user_ids, added_at))
+        pipe.zremrangebyrank(exclusions_key, 0, -recommendations_settings.exclusions_limit - 1)
+        pipe.expire(exclusions_key, recommendations_settings.exclusions_ttl)
+        # Готовая первая страница могла содержать исключенных пользователей
+        pipe.delete(RENDERED_KEY.format(user_id=user_id))
+        await pipe.execute()
+
+
+async def get_exclusions(cache_client: redis.Redis, user_id: int) -> np.ndarray | None:
+    """Получение пользователей, исключенных из рекомендаций пользователя.
+
+    :param cache_client: Клиент Redis.
+    :param user_id: Идентификатор пользователя.
+    :return: Идентификаторы исключенных пользователей или None, если исключений нет.
+    """
+    excluded_user_ids = await cache_client.zrange(EXCLUSIONS_KEY.format(user_id=user_id), 0, -1)
+    if not excluded_user_ids:
+        return None
+    return np.array([int(excluded_user_id) for excluded_user_id in excluded_user_ids], dtype=np.int64)
+
+
+def encode_neighbors(user_ids: np.ndarray, scores: np.ndarray) -> bytes:
+    """Упаковка списка похожих пользователей.
+
+    :param user_ids: Идентификаторы похожих пользователей.
+    :param scores: Оценки похожести.
+    :return: Список в виде последовательности записей фиксированной длины.
+    """
+    neighbors = np.empty(len(user_ids), dtype=NEIGHBORS_DTYPE)
+    neighbors['user_id'] = user_ids
+    neighbors['score'] = scores
+    return neighbors.tobytes()
+
+
+def decode_neighbors(raw: bytes) -> np.ndarray:
+    """Распаковка списка похожих пользователей.
+
+    :param raw: Упакованный список.
+    :return: Массив записей (user_id, score).
+    """
+    return np.frombuffer(raw, dtype=NEIGHBORS_DTYPE)
+
+
+def get_folded_dtype(dtype: str | np.dtype, k: int) -> np.dtype:
+    """Получение типа записи пользователя, добавленного без переобучения.
+
+    :param dtype: Тип данных матрицы P версии модели.
+    :param k: Количество латентных признаков.
+    :return: Тип записи (user_id, vector).
+    """
+    return np.dtype([('user_id', '<i8'), ('vector', np.dtype(dtype).newbyteorder('<'), (k,))])
+
+
+def encode_folded(user_id: int, vector: np.ndarray) -> bytes:
+    """Упаковка записи пользователя, добавленного без переобучения.
+
+    :param user_id: Идентификатор пользователя.
+    :param vector: Вектор пользователя в типе данных матрицы P версии модели.
+    :return: Запись фиксированной длины.
+    """
+    folded = np.empty(1, dtype=get_folded_dtype(vector.dtype, len(vector)))
+    folded['user_id'] = user_id
+    folded['vector'] = vector
+    return folded.tobytes()
+
+
+def encode_matrix(matrix: np.ndarray, dtype: str | np.dtype | None = None) -> bytes:
+    """Упаковка матрицы в бинарный формат.
+
+    Формат: заголовок (magic, версия, тип данных, размерность), размеры по
+    каждому измерению и сырые данные в порядке C little-endian.
+
+    :param matrix: Матрица.
+    :param dtype: Тип данных для хранения. По умолчанию - тип матрицы.
+    :raises ValueError: Тип данных не поддерживается форматом.
+    :return: Упакованная матрица.
+    """
+    dtype = np.dtype(dtype or matrix.dtype).newbyteorder('<')
+    if dtype not in MATRIX_DTYPE_CODES:
+        raise ValueError(f'Тип данных {dtype} не поддерживается.')
+
+    matrix = np.ascontiguousarray(matrix, dtype=dtype)
+    header = MATRIX_HEADER.pack(MATRIX_MAGIC, MATRIX_FORMAT_VERSION, MATRIX_DTYPE_CODES[dtype], matrix.ndim)
+    dims = b''.join(MATRIX_DIM.pack(dim) for dim in matrix.shape)
+    return header + dims + matrix.tobytes()
+
+
+def decode_matrix(raw: bytes) -> np.ndarray:
+    """Распаковка матрицы из бинарного формата без копирования данных.
+
+    :param raw: Упакованная матрица.
+    :raises ValueError: Данные не являются матрицей поддерживаемой версии.
+    :return: Матрица (только для чтения).
+    """
+    magic, version, dtype_code, ndim = MATRIX_HEADER.unpack_from(raw)
+    if magic != MATRIX_MAGIC or version != MATRIX_FORMAT_VERSION or dtype_code not in MATRIX_DTYPES:
+        raise ValueError('Некорректный формат матрицы.')
+
+    offset = MATRIX_HEADER.size
+    shape = []
+    for _ in range(ndim):
+        shape.append(MATRIX_DIM.unpack_from(raw, offset)[0])
+        offset += MATRIX_DIM.size
+
+    dtype = MATRIX_DTYPES[dtype_code]
+    count = int(np.prod(shape, dtype=np.int64))
+    return np.frombuffer(raw, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+class RecommendationsModel:
+    """Опубликованная модель рекомендаций."""
+
+    version: int
+    revision: int
+    P: np.ndarray
+    P_normalized: np.ndarray
+    user_ids: np.ndarray
+    rows: dict[int, int]
+    index: LSHIndex | None
+    folded: np.ndarray
+    folded_P_normalized: np.ndarray
+    folded_rows: dict[int, int]
+
+    def __init__(
+        self,
+        version: int,
+        revision: int,
+        P: np.ndarray,
+        user_ids: np.ndarray,
+        hyperplanes: np.ndarray | None = None,
+        folded: np.ndarray | None = None,
+    ):
+        self.version = version
+        # Номер изменения версии: растет при добавлении пользователей без переобучения
+        self.revision = revision
+        self.P = P
+        self.P_normalized = RecommendationsProcessor.normalize(P)
+        # Строка матрицы -> идентификатор пользователя
+        self.user_ids = user_ids
+        # Идентификатор пользователя -> строка матрицы
+        self.rows = dict(zip(user_ids.tolist(), range(len(user_ids))))
+        # Публикуются только гиперплоскости индекса, таблицы строятся по матрице при загрузке
+        self.index = None
+        if hyperplanes is not None:
+            self.index = LSHIndex(hyperplanes, self.P_normalized, probes=recommendations_settings.ann_probes)
+
+        # Пользователи, добавленные без переобучения, хранятся отдельно от матрицы версии и
+        # следуют за ее строками, поэтому их добавление не пересчитывает матрицу и индекс
+        self.folded_dtype = get_folded_dtype(P.dtype, P.shape[1])
+        self._set_folded(folded if folded is not None else np.empty(0, dtype=self.folded_dtype))
+
+    def _set_folded(self, folded: np.ndarray) -> None:
+        """Замена пользователей, добавленных без переобучения.
+
+        :param folded: Записи (user_id, vector).
+        """
+        self.folded = folded
+        self.folded_P_normalized = RecommendationsProcessor.normalize(folded['vector'])
+        self.folded_rows = dict(zip(folded['user_id'].tolist(), range(len(self.user_ids), self.rows_count)))
+
+    @classmethod
+    def from_snapshot(cls, version: int, values: list[bytes | None]) -> "RecommendationsModel":
+        """Создание модели из полей опубликованной версии.
+
+        :param version: Версия модели.
+        :param values: Значения полей `MODEL_FIELDS`.
+        :return: Модель без пользователей, добавленных без переобучения.
+        """
+        raw_P, raw_user_ids, raw_hyperplanes = values
+        return cls(
+            version,
+            0,
+            decode_matrix(raw_P),
+            decode_matrix(raw_user_ids),
+            decode_matrix(raw_hyperplanes) if raw_hyperplanes is not None else None,
+        )
+
+    def extend(self, revision: int, folded: np.ndarray) -> "RecommendationsModel":
+        """Получение модели с новыми пользователями, добавленными без переобучения.
+
+        Матрица версии, строки и индекс используются совместно с исходной моделью.
+
+        :param revision: Номер изменения версии.
+        :param folded: Новые записи (user_id, vector).
+        :return: Модель.
+        """
+        model = copy.copy(self)
+        model.revision = revision
+        if len(folded):
+            model._set_folded(np.concatenate([self.folded, folded]))
+        return model
+
+    @property
+    def rows_count(self) -> int:
+        """Количество пользователей в модели."""
+        return len(self.user_ids) + len(self.folded)
+
+    def get_user_ids(self, rows: np.ndarray) -> np.ndarray:
+        """Получение идентификаторов пользователей по строкам модели.
+
+        :param rows: Строки модели.
+        :return: Идентификаторы пользователей.
+        """
+        base = rows < len(self.user_ids)
+        user_ids = np.empty(len(rows), dtype=np.int64)
+        user_ids[base] = self.user_ids[rows[base]]
+        user_ids[~base] = self.folded['user_id'][rows[~base] - len(self.user_ids)]
+        return user_ids
+
+    def exclusion_mask(self, exclusions: np.ndarray) -> np.ndarray:
+        """Получение маски строк модели исключенных пользователей.
+
+        Строки находятся по словарям строк модели, поэтому время построения
+        маски зависит от количества исключений, а не пользователей.
+
+        :param exclusions: Идентификаторы исключенных пользователей.
+        :return: Булев массив, индексированный строкой модели.
+        """
+        mask = np.zeros(self.rows_count, dtype=np.bool_)
+        rows = [row for row in map(self.get_row, exclusions.tolist()) if row is not None]
+        mask[rows] = True
+        return mask
+
+    @classmethod
+    def _exact_search(
+        cls,
+        P_normalized: np.ndarray,
+        query: np.ndarray,
+        top_n: int,
+        mask: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Поиск похожих строк полным перебором.
+
+        :param P_normalized: Нормированная матрица.
+        :param query: Нормированный вектор запроса.
+        :param top_n: Количество строк.
+        :param mask: Булева маска исключенных строк.
+        :return: Строки, оценки похожести.
+        """
+        scores = P_normalized @ query
+        scores[mask] = -np.inf
+        rows = RecommendationsProcessor.top_k(scores[None], min(top_n, int(len(mask) - mask.sum())))[0]
+        return rows, scores[rows]
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_n: int,
+        exclude_row: int | None = None,
+        exclusions: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Поиск пользователей, похожих на вектор.
+
+        Если опубликован приближенный индекс, строки матрицы версии ищутся по
+        нему, иначе - перебором; добавленные без переобучения пользователи
+        всегда перебираются полностью.
+
+        :param query: Нормированный вектор.
+        :param top_n: Количество похожих пользователей.
+        :param exclude_row: Исключаемая строка модели (сам пользователь).
+        :param exclusions: Идентификаторы исключенных пользователей. Исключение применяется
+            при выборе лучших, поэтому возвращается полный список.
+        :return: Идентификаторы похожих пользователей, оценки похожести.
+        """
+        if exclusions is not None:
+            mask = self.exclusion_mask(exclusions)
+        else:
+            mask = np.zeros(self.rows_count, dtype=np.bool_)
+        if exclude_row is not None:
+            mask[exclude_row] = True
+
+        base_count = len(self.user_ids)
+        if self.index is not None:
+            rows, scores = self.index.query(query[None], top_n=top_n, mask=mask[:base_count])
+            rows, scores = rows[0], scores[0]
+        else:
+            rows, scores = self._exact_search(self.P_normalized, query, top_n, mask[:base_count])
+
+        if len(self.folded):
+            folded_rows, folded_scores = self._exact_search(
+                self.folded_P_normalized,
+                query,
+                top_n,
+                mask[base_count:],
+            )
+            rows = np.concatenate([rows, folded_rows + base_count])
+            scores = np.concatenate([scores, folded_scores])
+            selected = RecommendationsProcessor.top_k(scores[None], top_n)[0]
+            rows, scores = rows[selected], scores[selected]
+
+        return self.get_user_ids(rows), scores
+
+    def predict(
+        self,
+        user_row: int,
+        top_n: int,
+        exclusions: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Поиск похожих пользователей.
+
+        :param user_row: Строка модели пользователя.
+        :param top_n: Количество похожих пользователей.
+        :param exclusions: Идентификаторы исключенных пользователей.
+        :return: Идентификаторы похожих пользователей, оценки похожести.
+        """
+        if user_row < len(self.user_ids):
+            query = self.P_normalized[user_row]
+        else:
+            query = self.folded_P_normalized[user_row - len(self.user_ids)]
+        return self.search(query, top_n, exclude_row=user_row, exclusions=exclusions)
+
+    def get_row(self, user_id: int) -> int | None:
+        """Получение строки модели пользователя.
+
+        :param user_id: Идентификатор пользователя.
+        :return: Строка модели или None, если пользователя нет в модели.
+        """
+        row = self.rows.get(user_id)
+        return row if row is not None else self.folded_rows.get(user_id)
+
+
+class RecommendationsModelCache:
+    """Кэш опубликованной модели рекомендаций в памяти процесса.
+
+    Модель загружается из Redis только при смене версии; при ее изменении
+    дочитываются только добавленные пользователи. В остальных случаях запрос
+    стоит одного вызова скрипта, читающего указатель версии и номер изменения.
+    """
+
+    def __init__(self):
+        self._model: RecommendationsModel | None = None
+        self._lock = asyncio.Lock()
+
+    def _is_current(self, version: int, revision: int) -> bool:
+        """Проверка, что в кэше лежит указанное изменение версии модели."""
+        return self._model is not None and (self._model.version, self._model.revision) == (version, revision)
+
+    async def get(self, cache_client: redis.Redis) -> RecommendationsModel | None:
+        """Получение актуальной модели.
+
+        :param cache_client: Клиент Redis.
+        :return: Модель или None, если модель еще не опубликована.
+        """
+        snapshot = await get_model_snapshot(cache_client, MODEL_KEY, 'revision')
+        if snapshot is None:
+            return None
+
+        version, (raw_revision,) = snapshot
+        if self._is_current(version, int(raw_revision or 0)):
+            return self._model
+
+        async with self._lock:
+            if self._is_current(version, int(raw_revision or 0)):
+                return self._model
+
+            model = self._model
+            if model is None or model.version != version:
+                # Поля версии читаются одним скриптом, поэтому образуют согласованный снимок
+                snapshot = await get_model_snapshot(cache_client, MODEL_KEY, *MODEL_FIELDS)
+                if snapshot is None:
+                    return None
+                model = RecommendationsModel.from_snapshot(*snapshot)
+
+            # Номер изменения и добавленные пользователи читаются вместе, поэтому соответствуют друг другу
+            folded = await get_folded(cache_client, model.version, model.folded_dtype, len(model.folded))
+            if folded is not None and folded[1] is not None:
+                model = model.extend(*folded)
+            self._model = model
+
+        return self._model
+
+
+async def get_user_row(cache_client: redis.Redis, user_id: int) -> int | None:
+    """Получение строки матрицы пользователя без загрузки модели.
+
+    :param cache_client: Клиент Redis.
+    :param user_id: Идентификатор пользователя.
+    :return: Строка матрицы или None, если пользователя нет в модели.
+    """
+    snapshot = await get_model_snapshot(cache_client, USER_ROWS_KEY, str(user_id))
+    if snapshot is None or snapshot[1][0] is None:
+        return None
+    return int(snapshot[1][0])
@@ -0,0 +1,67 @@
+import operator
+from functools import lru_cache
+from typing import Any
+
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import to_json
+
+from config import get_settings
+
+settings = get_settings()
+
+
+@lru_cache
+def get_list_adapter(schema: type[BaseModel]) -> TypeAdapter:
+    """Получение заранее построенного адаптера для списка объектов схемы.
+
+    :param schema: Схема ответа.
+    :return: Адаптер `list[schema]`.
+    """
+    return TypeAdapter(list[schema])
+
+
+@lru_cache
+def get_fields_getter(schema: type[BaseModel]) -> tuple[tuple[str, ...], operator.attrgetter]:
+    """Получение имен полей схемы и функции чтения их значений из объекта.
+
+    :param schema: Схема ответа.
+    :return: Имена полей, функция, возвращающая кортеж значений полей.
+    """
+    fields = tuple(schema.model_fields)
+    return fields, operator.attrgetter(*fields)
+
+
+def _dump_fields(schema: type[BaseModel], obj: Any) -> dict[str, Any]:
+    """Получение полей схемы из объекта без валидации."""
+    fields, getter = get_fields_getter(schema)
+    return dict(zip(fields, getter(obj)))
+
+
+def dump_json(schema: type[BaseModel], obj: Any) -> bytes:
+    """Сериализация объекта по схеме ответа в JSON.
+
+    По умолчанию объект валидируется схемой, как при `response_model`. В
+    режиме `FAST_SERIALIZATION` поля схемы берутся из объекта без валидации:
+    ответы строятся из моделей БД, типы полей которых уже совпадают со схемой.
+
+    :param schema: Схема ответа.
+    :param obj: Объект, например, модель Tortoise.
+    :return: Тело ответа.
+    """
+    if settings.FAST_SERIALIZATION:
+        return to_json(_dump_fields(schema, obj))
+    return schema.model_validate(obj, from_attributes=True).model_dump_json().encode()
+
+
+def dump_json_list(schema: type[BaseModel], objs: list[Any]) -> bytes:
+    """Сериализация списка объектов по схеме ответа в JSON.
+
+    :param schema: Схема элемента ответа.
+    :param objs: Объекты.
+    :return: Тело ответа.
+    """
+    if settings.FAST_SERIALIZATION:
+        return to_json([_dump_fields(schema, obj) for obj in objs])
+
+    adapter = get_list_adapter(schema)
+    return adapter.dump_json(adapter.validate_python(objs, from_attributes=True))
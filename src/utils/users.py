@@ -0,0 +1,275 @@
+import datetime
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Iterable
+
+import redis.asyncio as redis
+
+from config import get_auth_settings
+from models import User
+from utils.recommendations import invalidate_rendered_recommendations
+
+auth_settings = get_auth_settings()
+
+# Данные пользователя по id, готовый ответ с профилем по id и индекс username -> id
+USER_KEY = 'users:{user_id}'
+PROFILE_KEY = 'users:{user_id}:profile'
+USER_ID_KEY = 'users:username:{username}'
+# Счетчики обращений к кэшу пользователей всех процессов
+USER_CACHE_METRICS_KEY = 'users:cache:metrics'
+USER_CACHE_METRICS = ('local_hits', 'cache_hits', 'misses')
+
+# Чтение данных пользователя по username за один запрос
+USER_CACHE_SCRIPT = '''
+local user_id = redis.call('GET', KEYS[1])
+if not user_id then
+    return false
+end
+local key = string.gsub(ARGV[1], '{user_id}', user_id)
+return redis.call('GET', key)
+'''
+
+# Чтение готового ответа с профилем по username за один запрос
+PROFILE_SCRIPT = '''
+local user_id = redis.call('GET', KEYS[1])
+if not user_id then
+    return false
+end
+local key = string.gsub(ARGV[1], '{user_id}', user_id)
+return redis.call('HMGET', key, 'username', 'etag', 'body')
+'''
+
+
+# Поля пользователя, не попадающие в кэш: хэш пароля не нужен для авторизации запросов
+USER_CACHE_EXCLUDED_FIELDS = frozenset({'password'})
+
+
+def dump_user(user: User) -> dict[str, Any]:
+    """Получение данных пользователя для кэша."""
+    return {
+        field: getattr(user, field)
+        for field in User._meta.db_fields
+        if field not in USER_CACHE_EXCLUDED_FIELDS
+    }
+
+
+def load_user(record: dict[str, Any]) -> User:
+    """Создание пользователя из данных кэша.
+
+    Каждый вызов возвращает новый объект, поэтому изменения объекта в
+    обработчике запроса не попадают в кэш. Поля, не попадающие в кэш, равны
+    None, поэтому объект помечен как частичный: сохранить его можно только
+    с явным перечислением полей.
+    """
+    user = User._init_from_db(
+        **dict.fromkeys(USER_CACHE_EXCLUDED_FIELDS),
+        **{
+            field: User._meta.fields_map[field].to_python_value(value)
+            for field, value in record.items()
+            if field not in USER_CACHE_EXCLUDED_FIELDS
+        },
+    )
+    user._partial = True
+    return user
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'Тип {type(value)} не сериализуется.')
+
+
+class UserCache:
+    """Двухуровневый кэш пользователей для авторизации запросов.
+
+    Первый уровень - словарь в памяти процесса с вытеснением давно не
+    использованных записей и коротким временем жизни, второй - Redis.
+    Данные в Redis хранятся по id пользователя и удаляются при сохранении
+    или удалении пользователя, поэтому username в данных сверяется с
+    запрошенным: переименованный или удаленный пользователь не находится,
+    как и при запросе в БД. Отсутствующие пользователи не кэшируются.
+
+    Записи первого уровня в других процессах остаются до истечения
+    `USER_CACHE_LOCAL_TTL` секунд. С той же периодичностью счетчики обращений
+    процесса добавляются к общим счетчикам в Redis, чтобы попадание в
+    память процесса не стоило запроса к Redis.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = auth_settings.USER_CACHE_SIZE,
+        local_ttl: float = auth_settings.USER_CACHE_LOCAL_TTL,
+        ttl: int = auth_settings.USER_CACHE_TTL,
+    ):
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        # username -> (время истечения, данные пользователя)
+        self._users: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        # Счетчики обращений, еще не добавленные к общим счетчикам в Redis
+        self.stats = dict.fromkeys(USER_CACHE_METRICS, 0)
+        self._stats_flushed_at = time.monotonic()
+
+    def _get_local(self, username: str) -> dict[str, Any] | None:
+        """Получение данных пользователя из памяти процесса."""
+        entry = self._users.get(username)
+        if entry is None:
+            return None
+
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            del self._users[username]
+            return None
+
+        self._users.move_to_end(username)
+        return record
+
+    def _set_local(self, username: str, record: dict[str, Any]) -> None:
+        """Сохранение данных пользователя в памяти процесса."""
+        self._users[username] = (time.monotonic() + self.local_ttl, record)
+        self._users.move_to_end(username)
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+
+    async def flush_stats(self, cache_client: redis.Redis) -> None:
+        """Добавление счетчиков обращений процесса к общим счетчикам в Redis.
+
+        :param cache_client: Клиент Redis.
+        """
+        stats, self.stats = self.stats, dict.fromkeys(USER_CACHE_METRICS, 0)
+        self._stats_flushed_at = time.monotonic()
+        async with cache_client.pipeline(transaction=False) as pipe:
+            for name, value in stats.items():
+                if value:
+                    pipe.hincrby(USER_CACHE_METRICS_KEY, name, value)
+            await pipe.execute()
+
+    async def get(self, cache_client: redis.Redis, username: str) -> User | None:
+        """Получение пользователя по username.
+
+        :param cache_client: Клиент Redis.
+        :param username: Имя пользователя.
+        :return: Пользователь или None, если пользователь не найден.
+        """
+        if time.monotonic() - self._stats_flushed_at >= self.local_ttl:
+            await self.flush_stats(cache_client)
+
+        if (record := self._get_local(username)) is not None:
+            self.stats['local_hits'] += 1
+            return load_user(record)
+
+        raw_record = await cache_client.register_script(USER_CACHE_SCRIPT)(
+            keys=[USER_ID_KEY.format(username=username)],
+            args=[USER_KEY],
+        )
+        if raw_record is not None and (record := json.loads(raw_record))['username'] == username:
+            self.stats['cache_hits'] += 1
+            self._set_local(username, record)
+            return load_user(record)
+
+        self.stats['misses'] += 1
+        user = await User.get_or_none(username=username)
+        if user is None:
+            return None
+
+        record = dump_user(user)
+        async with cache_client.pipeline(transaction=False) as pipe:
+            pipe.set(USER_KEY.format(user_id=user.id), json.dumps(record, default=_json_default), ex=self.ttl)
+            pipe.set(USER_ID_KEY.format(username=username), user.id, ex=self.ttl)
+            await pipe.execute()
+        self._set_local(username, record)
+        return user
+
+    def invalidate_local(self, user_ids: Iterable[int]) -> None:
+        """Удаление пользователей из памяти процесса.
+
+        :param user_ids: Идентификаторы пользователей.
+        """
+        user_ids = set(user_ids)
+        for username in [username for username, (_, record) in self._users.items() if record['id'] in user_ids]:
+            del self._users[username]
+
+
+user_cache = UserCache()
+
+
+async def get_user_cache_metrics(cache_client: redis.Redis) -> dict[str, int]:
+    """Получение метрик кэша пользователей всех процессов.
+
+    Счетчики процессов добавляются с задержкой до `USER_CACHE_LOCAL_TTL` секунд.
+
+    :param cache_client: Клиент Redis.
+    :return: Количество попаданий в память процесса (local_hits), в Redis (cache_hits) и промахов (misses).
+    """
+    metrics = await cache_client.hgetall(USER_CACHE_METRICS_KEY)
+    return {name: int(metrics.get(name.encode(), 0)) for name in USER_CACHE_METRICS}
+
+
+def get_profile_etag(user: User) -> str:
+    """Получение ETag профиля пользователя по времени последнего изменения.
+
+    :param user: Пользователь.
+    :return: ETag.
+    """
+    return f'"{user.id}-{int(user.updated_at.timestamp() * 1_000_000)}"'
+
+
+async def get_profile(cache_client: redis.Redis, username: str) -> tuple[str, bytes] | None:
+    """Получение готового ответа с профилем пользователя.
+
+    :param cache_client: Клиент Redis.
+    :param username: Имя пользователя.
+    :return: ETag и тело ответа или None, если ответа нет в кэше.
+    """
+    profile = await cache_client.register_script(PROFILE_SCRIPT)(
+        keys=[USER_ID_KEY.format(username=username)],
+        args=[PROFILE_KEY],
+    )
+    if profile is None or profile[0] is None or profile[0].decode() != username:
+        return None
+
+    _, etag, body = profile
+    return etag.decode(), body
+
+
+async def set_profile(cache_client: redis.Redis, user: User, body: bytes) -> str:
+    """Сохранение готового ответа с профилем пользователя.
+
+    :param cache_client: Клиент Redis.
+    :param user: Пользователь.
+    :param body: Тело ответа.
+    :return: ETag ответа.
+    """
+    etag = get_profile_etag(user)
+    profile_key = PROFILE_KEY.format(user_id=user.id)
+    async with cache_client.pipeline(transaction=False) as pipe:
+        pipe.hset(profile_key, mapping={'username': user.username, 'etag': etag, 'body': body})
+        pipe.expire(profile_key, auth_settings.USER_CACHE_TTL)
+        pipe.set(USER_ID_KEY.format(username=user.username), user.id, ex=auth_settings.USER_CACHE_TTL)
+        await pipe.execute()
+    return etag
+
+
+async def invalidate_users(cache_client: redis.Redis, user_ids: Iterable[int]) -> None:
+    """Удаление пользователей из кэша после изменения.
+
+    Вызывается из сигналов сохранения и удаления пользователя, а также после
+    изменений через `QuerySet.update` и `bulk_update`, которые сигналы не вызывают.
+    Вместе с пользователями удаляются готовые ответы со списками рекомендаций,
+    в которых они есть.
+
+    :param cache_client: Клиент Redis.
+    :param user_ids: Идентификаторы пользователей.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+
+    await cache_client.delete(
+        *(USER_KEY.format(user_id=user_id) for user_id in user_ids),
+        *(PROFILE_KEY.format(user_id=user_id) for user_id in user_ids),
+    )
+    user_cache.invalidate_local(user_ids)
+    # Профили пользователей показываются в чужих списках рекомендаций
+    await invalidate_rendered_recommendations(cache_client, user_ids)